@@ -16,7 +16,7 @@ def main():
     
     #Generates the water surfacer
     scene.generate_water("img/blue.jpg", 1000)
-    boids = Boids(skinning_shader, 19, "obj/Fish/BlueTang/BlueTang.fbx", scaling=0.003, index=0, tex_file="obj/Fish/BlueTang/BlueTang_Base_Color.png")
+    boids = Boids(scene.shaders['skinning_instanced'], 19, "obj/Fish/BlueTang/BlueTang.fbx", scaling=0.003, index=0, tex_file="obj/Fish/BlueTang/BlueTang_Base_Color.png", instanced=True)
     boids_placement = {
         "position": (-5, -15, 200)
     }
@@ -126,6 +126,9 @@ def main():
     print("Toggle polygon mode:")
     print("                       T")
     print("")
+    print("Draw calls, state changes and culled boxes of the last frame:")
+    print("                       I")
+    print("")
     print("Quit:")
     print("       Q")
 
@@ -0,0 +1,84 @@
+#version 330 core
+
+#define MAX_WAVES 16
+// texture coordinates in the square of the wave field around the camera
+in vec2 uv;
+
+// square of the sea floor covered by the texture, in model coordinates
+uniform vec2 field_origin;
+uniform float field_extent;
+
+uniform vec3 light_dir;
+uniform float time;
+
+// what the caustics of the sea floor need to know about the waves above:
+// the direction of the shift of the light ray intercept, and the height of
+// the water surface
+out vec4 field;
+
+struct GerstnerWave {
+    vec2 direction;
+    float amplitude;
+    float steepness;
+    float frequency;
+    float speed;
+};
+// waves shared by all the programs, uploaded by the application
+layout(std140) uniform GerstnerWaves {
+    int nb_waves;
+    GerstnerWave gerstner_waves[MAX_WAVES];
+};
+
+
+vec3 gerstner_wave_normal(vec3 position, float time) {
+    vec3 wave_normal = vec3(0.0, 1.0, 0.0);
+    for (int i = 0; i <nb_waves; ++i) {
+        float proj = dot(position.xz, gerstner_waves[i].direction),
+              phase = time * gerstner_waves[i].speed,
+              psi = proj * gerstner_waves[i].frequency + phase,
+              Af = gerstner_waves[i].amplitude *
+                   gerstner_waves[i].frequency,
+              alpha = Af * sin(psi);
+
+        wave_normal.y -= gerstner_waves[i].steepness * alpha;
+
+        float x = gerstner_waves[i].direction.x,
+              y = gerstner_waves[i].direction.y,
+              omega = Af * cos(psi);
+
+        wave_normal.x -= x * omega;
+        wave_normal.z -= y * omega;
+    } return wave_normal;
+}
+
+vec3 gerstner_wave_position(vec2 position, float time) {
+    vec3 wave_position = vec3(position.x, 0, position.y);
+    for (int i = 0; i < nb_waves; ++i) {
+        float proj = dot(position, gerstner_waves[i].direction),
+              phase = time * gerstner_waves[i].speed,
+              theta = proj * gerstner_waves[i].frequency + phase,
+              height = gerstner_waves[i].amplitude * sin(theta);
+
+        wave_position.y += height;
+
+        float maximum_width = gerstner_waves[i].steepness *
+                              gerstner_waves[i].amplitude,
+              width = maximum_width * cos(theta),
+              x = gerstner_waves[i].direction.x,
+              y = gerstner_waves[i].direction.y;
+
+        wave_position.x += x * width;
+        wave_position.z += y * width;
+    } return wave_position;
+}
+
+
+void main() {
+    vec2 position = field_origin + (uv - 0.5) * field_extent;
+    float height = gerstner_wave_position(position, time).y;
+
+    // the ray from the floor point p along wave_normal meets the plane
+    // dot(light_dir, x) = 230 at p + wave_normal * (230 - dot(light_dir, p)) / dot(wave_normal, light_dir)
+    vec3 wave_normal = gerstner_wave_normal(vec3(position.x, 0, position.y), time);
+    field = vec4(wave_normal.xz / dot(wave_normal, light_dir), height, 1);
+}
@@ -0,0 +1,9 @@
+#version 330 core
+
+// full screen triangle, no vertex attribute needed
+out vec2 uv;
+
+void main() {
+    uv = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2);
+    gl_Position = vec4(2 * uv - 1, 0, 1);
+}
@@ -16,9 +16,6 @@ uniform vec3 k_d;
 uniform vec3 k_s;
 uniform float s;
 
-// world camera position
-uniform vec3 w_camera_position;
-
 // textures
 uniform sampler2D diffuse_map;
 in vec2 frag_tex_coords;
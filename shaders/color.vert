@@ -4,7 +4,15 @@ layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
 layout(location = 2) in vec2 uv_coords;
 
-uniform mat4 model, view, projection;
+uniform mat4 model;
+
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
 
 // position and normal for the fragment shader, in WORLD coordinates
 out vec3 w_position, w_normal;   // in world coordinates
@@ -22,13 +30,13 @@ const float gradient = 1.3;
 
 void main() {
     world_coords = model * vec4(position, 1);
-    vec4 pos_to_cam =  view * world_coords;
-    gl_Position = projection * pos_to_cam;
+    vec4 pos_to_cam =  frame.view * world_coords;
+    gl_Position = frame.projection * pos_to_cam;
     
     w_normal = (model * vec4(normal, 0)).xyz;
 
     // Transformation
-    mat4 m = view * model;
+    mat4 m = frame.view * model;
     mat3 nit = mat3(transpose(inverse(m)));
     my_normal = nit * normal;
 
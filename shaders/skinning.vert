@@ -1,7 +1,12 @@
 #version 330 core
 
-// ---- camera geometry
-uniform mat4 projection, view;
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
 
 // ---- skinning globals and attributes
 const int MAX_VERTEX_BONES=4, MAX_BONES=128;
@@ -34,8 +39,8 @@ void main()
 
     // ------ compute world and normalized eye coordinates of our vertex
     wPosition4 = skinMatrix * vec4(position, 1.0);
-    vec4 position_relative_to_camera = view * wPosition4;
-    gl_Position = projection * position_relative_to_camera;
+    vec4 position_relative_to_camera = frame.view * wPosition4;
+    gl_Position = frame.projection * position_relative_to_camera;
 
     fragColor = color;
     frag_tex_coords = uv_coords;
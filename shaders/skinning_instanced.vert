@@ -0,0 +1,79 @@
+#version 330 core
+
+// ---- camera geometry
+uniform mat4 model;
+
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
+
+// ---- skinning globals, the bone matrices of the animation loop are baked
+// in bone_palette: one row per frame, 4 columns texels per bone
+const int MAX_VERTEX_BONES=4;
+uniform sampler2D bone_palette;
+uniform float duration;
+
+// ---- vertex attributes
+layout(location = 0) in vec3 position;
+layout(location = 1) in vec3 color;
+layout(location = 2) in vec2 uv_coords;
+layout(location = 3) in vec4 bone_ids;
+layout(location = 4) in vec4 bone_weights;
+
+// ---- instance attributes
+layout(location = 5) in mat4 instance_model;
+layout(location = 9) in float time_offset;
+
+// ----- interpolated attribute variables to be passed to fragment shader
+out vec3 fragColor;
+out vec2 frag_tex_coords;
+out vec4 wPosition4;
+
+
+// Underwater fog variables
+out float visibility;
+const float density = 0.007;
+const float gradient = 1.3;
+
+mat4 bone_matrix(int bone, int frame)
+{
+    return mat4(texelFetch(bone_palette, ivec2(4*bone, frame), 0),
+                texelFetch(bone_palette, ivec2(4*bone + 1, frame), 0),
+                texelFetch(bone_palette, ivec2(4*bone + 2, frame), 0),
+                texelFetch(bone_palette, ivec2(4*bone + 3, frame), 0));
+}
+
+void main()
+{
+    // ------ position in the animation loop at the scene time, between two
+    // baked frames
+    int frames = textureSize(bone_palette, 0).y;
+    float t = mod(frame.time + time_offset, duration) / duration * frames;
+    int previous = int(t) % frames;
+    int next = (previous + 1) % frames;
+    float fraction = fract(t);
+
+    // ------ creation of the skinning deformation matrix
+    mat4 skinMatrix = mat4(0);
+    for (int b=0; b < MAX_VERTEX_BONES; b++) {
+        int bone = int(bone_ids[b]);
+        mat4 bone_frames = (1 - fraction) * bone_matrix(bone, previous) + fraction * bone_matrix(bone, next);
+        skinMatrix += bone_weights[b] * bone_frames;
+    }
+
+    // ------ compute world and normalized eye coordinates of our vertex
+    wPosition4 = model * instance_model * skinMatrix * vec4(position, 1.0);
+    vec4 position_relative_to_camera = frame.view * wPosition4;
+    gl_Position = frame.projection * position_relative_to_camera;
+
+    fragColor = color;
+    frag_tex_coords = uv_coords;
+
+    // Underwater fog
+    float distance = length(position_relative_to_camera.xyz);
+    visibility = exp(-pow((distance * density), gradient));
+}
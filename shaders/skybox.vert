@@ -3,13 +3,19 @@
 in vec3 position;
 out vec3 textureCoords;
 
-uniform mat4 projection;
-uniform mat4 view;
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
 
 
 void main()
 {
-    vec4 pos = projection * view * vec4(position, 1);
+    // around the camera: rotation of the view only
+    vec4 pos = frame.projection * mat4(mat3(frame.view)) * vec4(position, 1);
     // Normalization
     gl_Position = pos.xyww;
     textureCoords = position;
@@ -1,119 +1,89 @@
 #version 330 core
 
-#define nb_waves 4
+#define MAX_WAVES 16
+
 // fragment position and normal of the fragment, in WORLD coordinates
 in vec3 w_position, w_normal;   // in world coodinates
 in vec3 my_normal;
 in vec3 pos;
 in float visibility;
 in vec4 world_coords;
-// light dir, in world coordinates
-uniform vec3 light_dir;
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
 
 // material properties
 uniform vec3 k_a;
 uniform vec3 k_d;
 uniform vec3 k_s;
 uniform float s;
-uniform float time;
-// world camera position
-uniform vec3 w_camera_position;
 
 // texture
 uniform sampler2D diffuse_map;
 uniform sampler2D caustics;
 
-in vec2 frag_tex_coords;
-
-out vec4 out_color;
+// waves above the sea floor around the camera, rendered by caustics.frag
+uniform sampler2D wave_field;
+uniform vec2 field_origin;
+uniform float field_extent;
 
-uniform struct GerstnerWave {
+struct GerstnerWave {
     vec2 direction;
     float amplitude;
     float steepness;
     float frequency;
     float speed;
 };
-GerstnerWave gerstner_waves[nb_waves] = GerstnerWave[](
-    GerstnerWave(vec2(0., 1.), 1.8, 0.2, 0.07, 0.5),
-    GerstnerWave(vec2(1., 0.), 2.5, 0.1, 0.02, 0.2),
-    GerstnerWave(vec2(-1, 0.7), 0.8, 0.5, 0.09, 0.4),
-    GerstnerWave(vec2(3., -4.), 1.2, 0.3, 0.04, 0.3)
-    );
+// waves shared by all the programs, read when there is no wave field
+layout(std140) uniform GerstnerWaves {
+    int nb_waves;
+    GerstnerWave gerstner_waves[MAX_WAVES];
+};
 
+in vec2 frag_tex_coords;
 
-vec3 gerstner_wave_normal(vec3 position, float time) {
-    vec3 wave_normal = vec3(0.0, 1.0, 0.0);
-    for (int i = 0; i <nb_waves; ++i) {
-        float proj = dot(position.xz, gerstner_waves[i].direction),
-              phase = time * gerstner_waves[i].speed,
-              psi = proj * gerstner_waves[i].frequency + phase,
-              Af = gerstner_waves[i].amplitude *
-                   gerstner_waves[i].frequency,
-              alpha = Af * sin(psi);
-
-        wave_normal.y -= gerstner_waves[i].steepness * alpha;
-
-        float x = gerstner_waves[i].direction.x,
-              y = gerstner_waves[i].direction.y,
-              omega = Af * cos(psi);
-
-        wave_normal.x -= x * omega;
-        wave_normal.z -= y * omega;
-    } return wave_normal;
-}
+out vec4 out_color;
 
-vec3 gerstner_wave_position(vec2 position, float time) {
-    vec3 wave_position = vec3(position.x, 0, position.y);
-    for (int i = 0; i < nb_waves; ++i) {
-        float proj = dot(position, gerstner_waves[i].direction),
-              phase = time * gerstner_waves[i].speed,
-              theta = proj * gerstner_waves[i].frequency + phase,
-              height = gerstner_waves[i].amplitude * sin(theta);
-
-        wave_position.y += height;
-
-        float maximum_width = gerstner_waves[i].steepness *
-                              gerstner_waves[i].amplitude,
-              width = maximum_width * cos(theta),
-              x = gerstner_waves[i].direction.x,
-              y = gerstner_waves[i].direction.y;
-
-        wave_position.x += x * width;
-        wave_position.z += y * width;
-    } return wave_position;
-}
 
-vec3 gerstner_wave(vec2 position, float time, inout vec3 normal) {
-    vec3 wave_position = gerstner_wave_position(position, time);
-    normal = gerstner_wave_normal(wave_position, time);
-    return wave_position; // Accumulated Gerstner Wave.
+// wave field at a point of the sea floor computed from the waves, as
+// caustics.frag does for the whole field
+vec4 gerstner_field(vec2 position, float time) {
+    vec3 wave_normal = vec3(0.0, 1.0, 0.0);
+    float height = 0;
+    for (int i = 0; i < nb_waves; ++i) {
+        float theta = dot(position, gerstner_waves[i].direction) * gerstner_waves[i].frequency
+                      + time * gerstner_waves[i].speed,
+              Af = gerstner_waves[i].amplitude * gerstner_waves[i].frequency;
+        height += gerstner_waves[i].amplitude * sin(theta);
+        wave_normal.y -= gerstner_waves[i].steepness * Af * sin(theta);
+        wave_normal.xz -= gerstner_waves[i].direction * Af * cos(theta);
+    }
+    return vec4(wave_normal.xz / dot(wave_normal, frame.light_dir), height, 1);
 }
 
-vec3 line_plane_intercept(vec3 lineP,
-                            vec3 lineN,
-                            vec3 planeN,
-                            float  planeD)
-{
-    float distance = (planeD - dot(planeN, lineP)) /dot(lineN, planeN);
-    return lineP + lineN * distance;
-}
 
 void main() {
     // Object frame
     vec3 n = normalize(w_normal);
-    vec3 n2 = normalize(w_normal);
-    vec3 wave = gerstner_wave(pos.xz, time, n2);
+    // wave field rendered around the camera, faded at its border into the
+    // waves computed here, also used beyond it and without a field
+    vec2 field_coords = field_extent > 0 ? (pos.xz - field_origin) / field_extent : vec2(1);
+    float inside = 1 - smoothstep(0.45, 0.5, max(abs(field_coords.x), abs(field_coords.y)));
+    vec4 field = texture(wave_field, field_coords + 0.5);
+    if (inside < 1)
+        field = mix(gerstner_field(pos.xz, frame.time), field, inside);
+    vec3 wave = vec3(pos.x, field.z, pos.z);
    // World frame
     //vec3 n = normalize(my_normal);
 
-    vec3 waveN = gerstner_wave_normal(pos, time);
-    vec3 intercept = line_plane_intercept(
-                    pos.xyz,
-                    waveN,
-                    light_dir, 230);
+    vec3 intercept = pos;
+    intercept.xz += field.xy * (230 - dot(frame.light_dir, pos));
 
-    vec3 l = normalize(light_dir);
+    vec3 l = normalize(frame.light_dir);
     vec3 r = reflect(-l, n);
     
     // Point P in camera space is the view vector
@@ -126,7 +96,7 @@ void main() {
         kd += vec4(pos.y/20, pos.y/20, pos.y/200, 1)/2;
 
     // Phong model + texture
-    if (light_dir == vec3(0, 0, 0))
+    if (frame.light_dir == vec3(0, 0, 0))
         out_color = kd;
     else
         out_color = kd * max(0, dot(n, l)) + vec4(k_a + k_s * pow(max(0, dot(r, v)), s), 1);
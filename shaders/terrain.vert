@@ -3,7 +3,23 @@
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
 
-uniform mat4 model, view, projection;
+uniform mat4 model;
+
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
+
+// ---- displaced mode: no vertex attributes, the vertices are the ones of a
+// flat grid cut in chunks of (chunk_cells+1)^2 vertices, gl_VertexID giving
+// the chunk and the vertex in it, raised by the heights of height_field
+uniform bool displaced;
+uniform sampler2D height_field;
+uniform int chunk_cells, chunks_x;
+uniform float grid_spacing, grid_translation;
 
 // position and normal for the fragment shader, in WORLD coordinates
 out vec3 w_position, w_normal;   // in world coordinates
@@ -17,21 +33,43 @@ out vec4 world_coords;
 const float density = 0.007;
 const float gradient = 1.3;
 
+float field_height(ivec2 texel)
+{
+    // 0 outside the height field, as the normals of the CPU terrain
+    ivec2 size = textureSize(height_field, 0);
+    if (any(lessThan(texel, ivec2(0))) || any(greaterThanEqual(texel, size)))
+        return 0.;
+    return texelFetch(height_field, texel, 0).r;
+}
+
 void main() {
-    pos = position;
-    world_coords = model * vec4(position, 1);
-    vec4 pos_to_cam =  view * world_coords;
-    gl_Position = projection * pos_to_cam;
+    vec3 vertex_position = position, vertex_normal = normal;
+    if (displaced) {
+        int side = chunk_cells + 1;
+        int chunk = gl_VertexID / (side*side), local = gl_VertexID % (side*side);
+        ivec2 size = textureSize(height_field, 0);
+        ivec2 texel = min(chunk_cells*ivec2(chunk % chunks_x, chunk / chunks_x) + ivec2(local % side, local / side),
+                          size - 1);
+        vec2 grid = grid_spacing * (vec2(texel) - 0.5*vec2(size - 1));
+        vertex_position = vec3(grid.x, field_height(texel) + grid_translation, grid.y);
+        vertex_normal = normalize(vec3(field_height(texel - ivec2(1, 0)) - field_height(texel + ivec2(1, 0)), 2,
+                                       field_height(texel - ivec2(0, 1)) - field_height(texel + ivec2(0, 1))));
+    }
+
+    pos = vertex_position;
+    world_coords = model * vec4(vertex_position, 1);
+    vec4 pos_to_cam =  frame.view * world_coords;
+    gl_Position = frame.projection * pos_to_cam;
     
     // Normals
-    w_normal = (model * vec4(normal, 0)).xyz;
+    w_normal = (model * vec4(vertex_normal, 0)).xyz;
 
     // Transformation
-    mat4 m = view * model;
+    mat4 m = frame.view * model;
     mat3 nit = mat3(transpose(inverse(m)));
-    my_normal = nit * normal;
+    my_normal = nit * vertex_normal;
 
-    frag_tex_coords = position.xz;
+    frag_tex_coords = vertex_position.xz;
 
     // Underwater fog
     float distance = length(pos_to_cam.xyz);
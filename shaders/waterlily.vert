@@ -1,5 +1,5 @@
 #version 330 core
-#define nb_waves 4
+#define MAX_WAVES 16
 
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
@@ -17,24 +17,30 @@ out vec4 world_coords;
 const float density = 0.007;
 const float gradient = 1;
 
-uniform float time;
-uniform mat4 model, view, projection;
+uniform mat4 model;
 
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
 
 
-uniform struct GerstnerWave {
+
+struct GerstnerWave {
     vec2 direction;
     float amplitude;
     float steepness;
     float frequency;
     float speed;
 };
-GerstnerWave gerstner_waves[nb_waves] = GerstnerWave[](
-    GerstnerWave(vec2(0., 1.), 1.8, 0.2, 0.07, 0.5),
-    GerstnerWave(vec2(1., 0.), 2.5, 0.1, 0.02, 0.2),
-    GerstnerWave(vec2(-1, 0.7), 0.8, 0.5, 0.09, 0.4),
-    GerstnerWave(vec2(3., -4.), 1.2, 0.3, 0.04, 0.3)
-    );
+// waves shared by all the programs, uploaded by the application
+layout(std140) uniform GerstnerWaves {
+    int nb_waves;
+    GerstnerWave gerstner_waves[MAX_WAVES];
+};
 
 vec3 gerstner_wave_normal(vec3 position, float time) {
     vec3 wave_normal = vec3(0.0, 1.0, 0.0);
@@ -90,13 +96,13 @@ void main() {
     vec3 newNormal = normal;
     world_coords = model * vec4(position, 1);
     pos = position;
-    pos.y += gerstner_wave(position.xz, time, newNormal).y;
-    gl_Position = projection * view * model * vec4(pos, 1);
+    pos.y += gerstner_wave(position.xz, frame.time, newNormal).y;
+    gl_Position = frame.projection * frame.view * model * vec4(pos, 1);
     // Normals
     w_normal = (model * vec4(normal, 0)).xyz;
 
     // Transformation
-    mat4 m = view * model;
+    mat4 m = frame.view * model;
     mat3 nit = mat3(transpose(inverse(m)));
     my_normal = nit * normal;
 
@@ -5,9 +5,13 @@ in vec3 w_position, w_normal;   // in world coodinates
 in vec3 my_normal;
 in vec3 pos;
 
-// light dir, in world coordinates
-uniform vec3 light_dir;
-uniform float time;
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
 
 // material properties
 uniform vec3 k_a;
@@ -15,9 +19,6 @@ uniform vec3 k_d;
 uniform vec3 k_s;
 uniform float s;
 
-// world camera position
-uniform vec3 w_camera_position;
-
 // textures
 uniform sampler2D diffuse_map;
 in vec2 frag_tex_coords;
@@ -30,7 +31,7 @@ void main() {
     // World frame
     //vec3 n = normalize(my_normal);
 
-    vec3 l = normalize(light_dir);
+    vec3 l = normalize(frame.light_dir);
     vec3 r = reflect(-l, n);
     
     // Point P in camera space is the view vector
@@ -41,7 +42,7 @@ void main() {
 
     // Phong model + texture
     float alpha = 0.7;
-    if (light_dir == vec3(0, 0, 0)) {
+    if (frame.light_dir == vec3(0, 0, 0)) {
         out_color = kd;
         out_color.a = alpha;
     } else {
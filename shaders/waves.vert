@@ -1,5 +1,5 @@
 #version 330 core
-#define nb_waves 4
+#define MAX_WAVES 16
 
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
@@ -10,24 +10,41 @@ out vec3 my_normal;
 out vec3 pos;
 out vec2 frag_tex_coords;
 
-uniform float time;
-uniform mat4 model, view, projection;
+uniform mat4 model;
 
+// camera, light and scene time of the frame, shared by all the programs
+layout(std140) uniform Frame {
+    mat4 view, projection, view_inverse, projection_inverse;
+    vec3 w_camera_position;
+    float time;
+    vec3 light_dir;
+} frame;
 
+// clipmap ring: spacing between its vertices, model (x, z) of its center,
+// half size in vertices and whether it blends into a coarser ring
+uniform float lod_spacing, lod_half_size, lod_morph;
+uniform vec2 lod_origin;
 
-uniform struct GerstnerWave {
+// spectral ocean: tiling displacement and normal textures of a square patch
+// of ocean_length units, sampled instead of summing the Gerstner waves
+uniform bool spectral;
+uniform sampler2D ocean_displacement, ocean_normals;
+uniform float ocean_length;
+
+
+
+struct GerstnerWave {
     vec2 direction;
     float amplitude;
     float steepness;
     float frequency;
     float speed;
 };
-GerstnerWave gerstner_waves[nb_waves] = GerstnerWave[](
-    GerstnerWave(vec2(0., 1.), 1.8, 0.2, 0.07, 0.5),
-    GerstnerWave(vec2(1., 0.), 2.5, 0.1, 0.02, 0.2),
-    GerstnerWave(vec2(-1, 0.7), 0.8, 0.5, 0.09, 0.4),
-    GerstnerWave(vec2(3., -4.), 1.2, 0.3, 0.04, 0.3)
-    );
+// waves shared by all the programs, uploaded by the application
+layout(std140) uniform GerstnerWaves {
+    int nb_waves;
+    GerstnerWave gerstner_waves[MAX_WAVES];
+};
 
 vec3 gerstner_wave_normal(vec3 position, float time) {
     vec3 wave_normal = vec3(0.0, 1.0, 0.0);
@@ -80,18 +97,33 @@ vec3 gerstner_wave(vec2 position, float time, inout vec3 normal) {
 
 
 
+// odd vertices slide onto the even ones close to the ring border, where
+// the ring has the same shape as the coarser one around it, leaving no crack
+vec2 lod_position(vec2 grid) {
+    float border = max(abs(grid.x), abs(grid.y)) / lod_half_size,
+          blend = lod_morph * clamp((border - 0.7) / 0.25, 0., 1.);
+    return lod_origin + (grid - mod(grid, 2.) * blend) * lod_spacing;
+}
+
+
 void main() {
-    vec3 newNormal = normal;
-    pos = gerstner_wave(position.xz, time, newNormal);
+    vec3 newNormal = normal, surface_normal = normal;
+    vec2 rest = lod_position(position.xz);
+    if (spectral) {
+        vec2 uv = rest / ocean_length + 0.5 / textureSize(ocean_displacement, 0);
+        pos = vec3(rest.x, 0, rest.y) + textureLod(ocean_displacement, uv, 0).xyz;
+        surface_normal = textureLod(ocean_normals, uv, 0).xyz;
+    } else
+        pos = gerstner_wave(rest, frame.time, newNormal);
     //pos = position*cos(time);
-    gl_Position = projection * view * model * vec4(pos, 1);
+    gl_Position = frame.projection * frame.view * model * vec4(pos, 1);
     // Normals
-    w_normal = (model * vec4(normal, 0)).xyz;
+    w_normal = (model * vec4(surface_normal, 0)).xyz;
 
     // Transformation
-    mat4 m = view * model;
+    mat4 m = frame.view * model;
     mat3 nit = mat3(transpose(inverse(m)));
-    my_normal = nit * normal;
+    my_normal = nit * surface_normal;
 
     frag_tex_coords = pos.xz;
 }
@@ -1,5 +1,11 @@
+from src.cache import *
+from src.flock import *
 from src.meshes import *
 from src.nodes import *
 from src.objects import *
+from src.ocean import *
+from src.parallel import *
+from src.recording import *
+from src.terrain import *
 from src.transform import *
 from src.viewer import *
\ No newline at end of file
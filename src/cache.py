@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of generated arrays, read back through memory maps
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'underwater_scene_cache')
+MANIFEST = 'manifest.json'
+ORPHAN_AGE = 3600   # seconds, past which a directory being written was left by a crash
+
+
+class ArrayCache:
+    """
+    Directory of entries of named arrays, one .npy file per array so that a
+    hit is a memory map uploaded as is; entries are keyed by a hash of the
+    contents of the files they are made from and of their parameters, and
+    the least recently used ones are removed when the cache outgrows
+    max_bytes
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=2**30):
+        self.directory, self.max_bytes = directory, max_bytes
+        self.hits = self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.remove_orphans()
+
+    def remove_orphans(self, age=ORPHAN_AGE):
+        """ Remove the directories written aside by store (named key.suffix)
+            older than age seconds, never renamed as their writer crashed """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            temporary = os.path.join(self.directory, name)
+            try:
+                if '.' in name and os.path.isdir(temporary) and now - os.path.getmtime(temporary) > age:
+                    shutil.rmtree(temporary, ignore_errors=True)
+            except OSError:
+                continue    # removed meanwhile by another process
+
+    @staticmethod
+    def key(*files, **parameters):
+        """
+        Hash of the contents of the files and of the parameters: a changed
+        file, e.g. a height map or the module generating the arrays, makes
+        the former entries stale and never read again
+        """
+        digest = hashlib.sha1()
+        for path in files:
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(2**20), b''):
+                    digest.update(block)
+        digest.update(repr(sorted(parameters.items())).encode())
+        return digest.hexdigest()
+
+    def load(self, key):
+        """ Arrays of an entry as read only memory maps, None if missing or
+            incomplete, e.g. after an interrupted store """
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, MANIFEST)) as file:
+                manifest = json.load(file)
+            arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in manifest}
+            if any(list(array.shape) != manifest[name] for name, array in arrays.items()):
+                raise ValueError('truncated entry')
+        except (OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+            self.misses += 1
+            return None
+        os.utime(os.path.join(entry, MANIFEST))    # most recently used
+        self.hits += 1
+        return arrays
+
+    def store(self, key, **arrays):
+        """ Save an entry, written aside then renamed so that readers never
+            see it partly written, and evict the oldest entries """
+        temporary = tempfile.mkdtemp(prefix=key + '.', dir=self.directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary, name + '.npy'), np.asarray(array))
+        with open(os.path.join(temporary, MANIFEST), 'w') as file:
+            json.dump({name: list(np.shape(array)) for name, array in arrays.items()}, file)
+        try:
+            os.rename(temporary, os.path.join(self.directory, key))
+        except OSError:     # stored meanwhile by another process
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """ (last use time, size in bytes, path) of the entries, oldest first """
+        entries = []
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            try:
+                used = os.path.getmtime(os.path.join(entry, MANIFEST))
+                size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+            except OSError:
+                continue    # being written, or not an entry
+            entries.append((used, size, entry))
+        return sorted(entries)
+
+    def evict(self):
+        """ Remove the least recently used entries past max_bytes """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
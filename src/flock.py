@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Array-backed boids simulation, independent of any OpenGL state
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class SpatialGrid:
+    """
+    Uniform grid neighbour index: boids are sorted by the key of their cell,
+    so that the boids of a cell are contiguous in the sorted order
+    """
+    SHIFT = 2**21           # number of cells along one axis of the key space
+    OFFSETS = np.indices((3, 3, 3)).reshape(3, -1).T - 1
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.keys = None
+        self.order = None
+        self.rebuilds = 0
+
+    def _keys(self, cells):
+        """ Integer key of each cell, cells being an (..., 3) integer array """
+        cells = cells + self.SHIFT // 2
+        return (cells[..., 0] * self.SHIFT + cells[..., 1]) * self.SHIFT + cells[..., 2]
+
+    def update(self, positions):
+        """
+        Update the cell of every boid; the sort is only redone when a boid
+        changed cell, starting from the previous order which is nearly sorted
+        """
+        keys = self._keys(np.floor(positions / self.cell_size).astype(np.int64))
+        if self.keys is not None and len(keys) == len(self.keys):
+            if np.array_equal(keys, self.keys):
+                return
+            self.order = self.order[np.argsort(keys[self.order], kind='stable')]
+        else:
+            self.order = np.argsort(keys, kind='stable')
+        self.keys = keys
+        self.rebuilds += 1
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True)
+
+    def neighbours(self, positions, radius):
+        """
+        Pairs (i, j) of distinct boids closer than radius, found by only
+        scanning the 27 cells around each boid
+        """
+        if radius != self.cell_size:
+            self.cell_size, self.keys = radius, None
+        self.update(positions)
+
+        # cells around each boid, looked up among the occupied ones
+        deltas = self._keys(self.OFFSETS) - self._keys(np.zeros(3, np.int64))
+        candidates = (self.keys[:, None] + deltas).ravel()
+        slots = np.searchsorted(self.cell_keys, candidates)
+        slots[slots == len(self.cell_keys)] = 0
+        found = self.cell_keys[slots] == candidates
+        boids = np.repeat(np.arange(len(positions)), len(deltas))[found]
+        starts, counts = self.cell_starts[slots[found]], self.cell_counts[slots[found]]
+
+        # one pair per boid of each neighbouring cell
+        rows = np.repeat(boids, counts)
+        firsts = np.repeat(np.cumsum(counts) - counts, counts)
+        cols = self.order[np.repeat(starts, counts) + np.arange(len(rows)) - firsts]
+
+        offsets = positions[rows] - positions[cols]
+        distances = np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+        close = (distances < radius) & (rows != cols)
+        return rows[close], cols[close], offsets[close], distances[close]
+
+
+class Environment:
+    """
+    Obstacles the boids steer away from, in world coordinates: sea floor
+    given by a vectorized height function, water surface and spheres
+    """
+    def __init__(self, margin=3, strength=10):
+        self.margin = margin        # distance at which the boids react
+        self.strength = strength    # intensity of the push at contact
+        self.floor = None           # function (x, z) -> heights, on arrays
+        self.surface = None         # height of the water surface, or function like floor
+        self.centers = np.zeros((0, 3), np.float32)
+        self.radii = np.zeros(0, np.float32)
+
+    def add_sphere(self, center, radius):
+        """ Add a spherical obstacle, e.g. the bounding sphere of an object """
+        self.centers = np.vstack([self.centers, np.asarray(center, np.float32)[:3]])
+        self.radii = np.append(self.radii, np.float32(radius))
+
+    def _push(self, gaps):
+        """ Intensity of the push, growing linearly when the gap closes """
+        return self.strength * np.clip(1 - gaps / self.margin, 0, None)
+
+    def avoidance(self, positions):
+        """ Push away from the obstacles for every position at once """
+        push = np.zeros_like(positions)
+        if self.floor is not None:
+            gaps = positions[:, 1] - self.floor(positions[:, 0], positions[:, 2])
+            push[:, 1] += self._push(gaps)
+        if self.surface is not None:
+            surface = self.surface
+            if callable(surface):
+                surface = surface(positions[:, 0], positions[:, 2])
+            push[:, 1] -= self._push(surface - positions[:, 1])
+        if len(self.radii):
+            offsets = positions[:, None, :] - self.centers[None, :, :]
+            distances = np.linalg.norm(offsets, axis=2)
+            directions = offsets / np.maximum(distances, 1e-6)[..., None]
+            push += np.einsum('ij,ijk->ik', self._push(distances - self.radii), directions)
+        return push
+
+
+class Flock:
+    """ Flock state stored as contiguous N x 3 float32 arrays """
+    def __init__(self, number, perception=2, deltat=1e-1, max_speed=2, max_force=5, bound=10, indexed=True):
+        self.number = number
+        self.perception = perception
+        self.deltat = deltat
+        self.max_speed = max_speed
+        self.max_force = max_force
+        self.bound = bound      # the boids stay in the box [-bound, bound]^3
+        self.grid = SpatialGrid(perception) if indexed else None
+        self.environment = None         # obstacles, see Environment
+        self.frame = np.identity(4, np.float32)     # flock to world coordinates
+
+        # smallest cube holding all the boids, positioned and centered
+        n = round(number ** (1./3))
+        n += int(n**3 < number)
+        grid = np.indices((n, n, n)).reshape(3, -1).T[:number]
+        self.positions = np.ascontiguousarray(3 * (grid - (n-1) / 2), np.float32)
+
+        speed, force = np.sqrt(3*self.max_speed**2), np.sqrt(3*self.max_force**2)
+        self.velocities = np.random.uniform(0, speed, (number, 3)).astype(np.float32)
+        self.accelerations = np.random.uniform(0, force, (number, 3)).astype(np.float32)
+        self.orientations = self.velocities / np.linalg.norm(self.velocities, axis=1, keepdims=True)
+
+    def neighbours(self):
+        """
+        Pairs (i, j) of distinct boids perceiving each other, returned as
+        index arrays with the offsets p_i - p_j and the distances
+        """
+        if self.grid is not None:
+            return self.grid.neighbours(self.positions, self.perception)
+        offsets = self.positions[:, None, :] - self.positions[None, :, :]
+        distances = np.sqrt(np.einsum('ijk,ijk->ij', offsets, offsets))
+        mask = distances < self.perception
+        np.fill_diagonal(mask, False)
+        rows, cols = np.nonzero(mask)
+        return rows, cols, offsets[rows, cols], distances[rows, cols]
+
+    def _clamp(self, vectors, maximum):
+        """ Rescale in place the rows of vectors longer than maximum """
+        norms = np.linalg.norm(vectors, axis=1)
+        too_long = norms > maximum
+        vectors[too_long] *= (maximum / norms[too_long])[:, None]
+        return vectors
+
+    def _sum(self, rows, values):
+        """ Sum values (one row per pair) for each boid i of the pairs """
+        return np.stack([np.bincount(rows, values[:, k], self.number) for k in range(3)], axis=1)
+
+    def steer(self):
+        """ Alignement, cohesion and separation rules in one neighbour pass """
+        rows, cols, offsets, distances = self.neighbours()
+        total = np.bincount(rows, minlength=self.number)
+        close = total > 0
+        if not close.any():
+            return
+        total = total[close, None]
+        positions, velocities = self.positions[close], self.velocities[close]
+
+        # alignement of the orientation with the average neighbour velocity
+        average = self._sum(rows, self.velocities[cols])[close] / total
+        norms = np.linalg.norm(average, axis=1, keepdims=True)
+        average = np.divide(average, norms, out=np.zeros_like(average), where=norms > 0) * self.max_speed
+        alignement = average - velocities
+
+        # cohesion towards the center of mass of the neighbours
+        vector_to_center = self._sum(rows, self.positions[cols])[close] / total - positions
+        norms = np.linalg.norm(vector_to_center, axis=1, keepdims=True)
+        vector_to_center = np.divide(vector_to_center, norms, out=vector_to_center, where=norms > 0) * self.max_speed
+        cohesion = self._clamp(vector_to_center - velocities, self.max_force)
+
+        # separation from the neighbours, weighted by the inverse distance
+        away = offsets / np.maximum(distances, np.finfo(np.float32).tiny)[:, None]
+        separation = self._clamp(self._sum(rows, away)[close] / total - velocities, self.max_force)
+
+        self.accelerations[close] += alignement + self.deltat * (cohesion + separation)
+
+    def edges(self):
+        """ If a boid hits an edge of the box, its velocity along this axis is inverted and so is the acceleration """
+        hit = ((self.positions > self.bound) & (self.velocities > 0)) | \
+              ((self.positions < -self.bound) & (self.velocities < 0))
+        self.velocities[hit] *= -1
+        self.accelerations[hit] *= -1
+
+    def update_positions(self):
+        """ Explicit Euler step, the speed being limited to max_speed """
+        self.edges()
+        self.positions += self.deltat * self.velocities
+        self.velocities += self.deltat * self.accelerations
+        self._clamp(self.velocities, self.max_speed)
+        norms = np.linalg.norm(self.velocities, axis=1, keepdims=True)
+        np.divide(self.velocities, norms, out=self.orientations, where=norms > 0)
+
+    def avoid(self):
+        """ Steer away from the obstacles of the environment, the push being
+            computed in world coordinates """
+        if self.environment is None:
+            return
+        linear = self.frame[:3, :3]
+        push = self.environment.avoidance(self.positions @ linear.T + self.frame[:3, 3])
+        push = np.linalg.solve(linear, push.T).T.astype(np.float32)
+
+        # like at the edges, nothing keeps going towards an obstacle
+        norms = np.linalg.norm(push, axis=1, keepdims=True)
+        directions = np.divide(push, norms, out=np.zeros_like(push), where=norms > 0)
+        for vectors in (self.velocities, self.accelerations):
+            towards = np.einsum('ij,ij->i', vectors, directions)
+            vectors -= np.minimum(towards, 0)[:, None] * directions
+        self.velocities += self.deltat * self._clamp(push, self.max_force)
+
+    def step(self):
+        """ One simulation step of the whole flock """
+        self.steer()
+        self.avoid()
+        self.update_positions()
+
+    def model_matrices(self, scaling=1):
+        """ Translation @ scaling @ rotation 4x4 matrices of every boid """
+        return model_matrices(self.positions, self.orientations, scaling)
+
+
+class FlockScheduler:
+    """
+    Advances a flock at a fixed tick rate in a background thread; the two
+    last ticks are kept in two preallocated buffers, swapped at every tick,
+    so that the rendering can interpolate between them
+    """
+    def __init__(self, flock, tick_rate=60, max_catch_up=5, recorder=None):
+        self.flock = flock
+        self.recorder = recorder            # e.g. a FlockRecorder, fed every tick
+        if recorder is not None:
+            recorder.append(flock)          # initial state, as record does
+        self.period = 1 / tick_rate
+        self.max_catch_up = max_catch_up    # ticks run at most per wake up
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.ticks, self.dropped = 0, 0
+        # [tick time, positions, orientations] of the two last ticks
+        now = time.perf_counter()
+        self.previous, self.current = ([now, flock.positions.copy(), flock.orientations.copy()] for _ in range(2))
+
+    def _snapshot(self, snapshot, tick_time):
+        """ Copy the state of the flock in a buffer """
+        snapshot[0] = tick_time
+        np.copyto(snapshot[1], self.flock.positions)
+        np.copyto(snapshot[2], self.flock.orientations)
+
+    def start(self):
+        """ Start the worker thread, if not already running """
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """ Stop the worker thread after its current tick """
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """ Worker loop: catch up with the wall clock then sleep until next tick """
+        next_tick = time.perf_counter() + self.period
+        while not self.stopped.is_set():
+            # ticks due by now; too far behind, the simulation is slowed
+            # down instead of catching up, the ticks past max_catch_up are
+            # dropped
+            late = time.perf_counter() - next_tick
+            due = int(late / self.period) + 1 if late >= 0 else 0
+            ticks = min(due, self.max_catch_up)
+            for _ in range(ticks):
+                self.flock.step()
+                if self.recorder is not None:
+                    self.recorder.append(self.flock)
+                # the oldest buffer gets the new tick, not while being read
+                with self.lock:
+                    self.previous, self.current = self.current, self.previous
+                    self._snapshot(self.current, next_tick)
+                next_tick += self.period
+            self.ticks += ticks
+            self.dropped += due - ticks
+            next_tick += (due - ticks) * self.period
+            self.stopped.wait(max(0, next_tick - time.perf_counter()))
+
+    def state(self, now=None):
+        """ Positions and orientations interpolated between the two last ticks """
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            previous, current = self.previous, self.current
+            alpha = np.clip((now - current[0]) / self.period, 0, 1)
+            positions = previous[1] + alpha * (current[1] - previous[1])
+            orientations = previous[2] + alpha * (current[2] - previous[2])
+            norms = np.linalg.norm(orientations, axis=1, keepdims=True)
+            orientations = np.divide(orientations, norms, out=current[2].copy(), where=norms > 0)
+        return positions, orientations
+
+    def model_matrices(self, scaling=1):
+        """ Model matrices of the interpolated state """
+        return model_matrices(*self.state(), scaling)
+
+
+def rotation_matrices(orientations):
+    """
+    Rotations turning the z axis of the models onto the orientations,
+    computed for every boid at once with Rodrigues' formula
+    """
+    x, y, z = orientations.T
+    # rotation of 180 degrees around x when the orientation is exactly -z
+    k = np.divide(1, 1 + z, out=np.zeros_like(z), where=z > -1 + 1e-6)
+    rotations = np.empty((len(orientations), 3, 3), np.float32)
+    rotations[:, 0] = np.stack([1 - x*x*k, -x*y*k, x], axis=1)
+    rotations[:, 1] = np.stack([-x*y*k, 1 - y*y*k, y], axis=1)
+    rotations[:, 2] = np.stack([-x, -y, z], axis=1)
+    flipped = z <= -1 + 1e-6
+    rotations[flipped] = np.diag((1, -1, -1))
+    return rotations
+
+
+def model_matrices(positions, orientations, scaling=1):
+    """ Translation @ scaling @ rotation 4x4 matrices of every boid """
+    matrices = np.zeros((len(positions), 4, 4), np.float32)
+    matrices[:, :3, :3] = scaling * rotation_matrices(orientations)
+    matrices[:, :3, 3] = positions
+    matrices[:, 3, 3] = 1
+    return matrices
@@ -5,29 +5,45 @@ Mesh classes
 
 from src.viewer import *
 from src.nodes import *
-import time
 
 MAX_BONES = 128
 MAX_VERTEX_BONES = 4
+SKINNED_BOX_POSES = 16     # poses of the animation the box of a skinned model holds
 
 
 class Mesh:
-    """ Mesh to refactor all previous classes """
-    def __init__(self, shader, attributes, index=None):
+    """ Mesh to refactor all previous classes, queued while a RenderQueue
+        collects unless queued is False, e.g. for meshes setting more state
+        than their program, diffuse texture and vertex array, or drawn after
+        the queued ones back to front if blended """
+    queued = True
+    blended = False
+
+    def __init__(self, shader, attributes, index=None, usage=GL.GL_STATIC_DRAW):
         self.shader = shader
-        names = ['view', 'projection', 'model']
-        self.loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
-        self.vertex_array = VertexArray(attributes, index)
+        # view and projection are read from the Frame block, see FrameContext
+        self.loc = {'model': GL.glGetUniformLocation(shader.glid, 'model')}
+        self.vertex_array = VertexArray(attributes, index, usage)
+
+    def state(self):
+        """ Program, diffuse texture (0 for none) and vertex array """
+        return self.shader.glid, 0, self.vertex_array.glid
 
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
+        if self.blended and RenderQueue.current is not None:
+            RenderQueue.current.add_blended(self, view @ model, projection, view, model, primitives)
+        elif self.queued and RenderQueue.current is not None:
+            RenderQueue.current.add(self, projection, view, model, primitives)
+        else:
+            RenderQueue.bind(self.state())
+            self.draw_item(projection, view, model, primitives)
 
-        GL.glUniformMatrix4fv(self.loc['view'], 1, True, view)
-        GL.glUniformMatrix4fv(self.loc['projection'], 1, True, projection)
-        GL.glUniformMatrix4fv(self.loc['model'], 1, True, model)
+    def draw_item(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        """ Per draw uniforms and draw call, the state being set """
+        GLState.uniform(GL.glUniformMatrix4fv, self.loc['model'], 1, True, model)
 
         # draw triangle as GL_TRIANGLE vertex array, draw array call
-        self.vertex_array.execute(primitives)
+        self.vertex_array.draw(primitives)
 
 
 class PhongMesh(Mesh):
@@ -38,33 +54,25 @@ class PhongMesh(Mesh):
         super().__init__(shader, attributes, index)
         self.light_dir = light_dir
         self.k_a, self.k_d, self.k_s, self.s = k_a, k_d, k_s, s
-        self.begin = 0
 
-        # retrieve OpenGL locations of shader variables at initialization
-        names = ['light_dir', 'k_a', 's', 'k_s', 'k_d', 'w_camera_position', 'time']
+        # retrieve OpenGL locations of shader variables at initialization,
+        # camera position and time being read from the Frame block
+        names = ['light_dir', 'k_a', 's', 'k_s', 'k_d']
 
         loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
         self.loc.update(loc)
 
-    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
-
+    def draw_item(self, projection, view, model, primitives=GL.GL_TRIANGLES):
         # setup light parameters
-        GL.glUniform3fv(self.loc['light_dir'], 1, self.light_dir)
+        GLState.uniform(GL.glUniform3fv, self.loc['light_dir'], 1, self.light_dir)
 
         # setup material parameters
-        GL.glUniform3fv(self.loc['k_a'], 1, self.k_a)
-        GL.glUniform3fv(self.loc['k_d'], 1, self.k_d)
-        GL.glUniform3fv(self.loc['k_s'], 1, self.k_s)
-        GL.glUniform1f(self.loc['s'], max(self.s, 0.001))
-        timesup = time.time() - self.begin
-        GL.glUniform1f(self.loc['time'], timesup)
-
-        # world camera position for Phong illumination specular component
-        w_camera_position = np.linalg.inv(view)[:,3]
-        GL.glUniform3fv(self.loc['w_camera_position'], 1, w_camera_position)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_a'], 1, self.k_a)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_d'], 1, self.k_d)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_s'], 1, self.k_s)
+        GLState.uniform(GL.glUniform1f, self.loc['s'], max(self.s, 0.001))
 
-        super().draw(projection, view, model, primitives)
+        super().draw_item(projection, view, model, primitives)
 
 
 
@@ -76,9 +84,6 @@ class ComplexMesh(PhongMesh):
 
         super().__init__(shader, attributes, index, light_dir, k_a, k_d, k_s, s)
 
-        loc = {'diffuse_map': GL.glGetUniformLocation(shader.glid, 'diffuse_map')}
-        self.loc.update(loc)
-
         # interactive toggles
         self.wrap = cycle([GL.GL_REPEAT, GL.GL_MIRRORED_REPEAT,
                            GL.GL_CLAMP_TO_BORDER, GL.GL_CLAMP_TO_EDGE])
@@ -99,62 +104,117 @@ class ComplexMesh(PhongMesh):
             self.filter_mode = next(self.filter)
             self.texture = Texture(self.file, self.wrap_mode, *self.filter_mode)
 
-    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
-
-        # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(self.loc['diffuse_map'], 0)
-
-        super().draw(projection, view, model, primitives)
+    def state(self):
+        """ Texture read by diffuse_map, left to its default unit 0 """
+        return self.shader.glid, self.texture.glid, self.vertex_array.glid
 
 
 class SkinnedMesh:
-    """ Class of skinned mesh nodes in scene graph """
+    """ Class of skinned mesh nodes in scene graph, queued as Mesh """
+    queued = True
+
     def __init__(self, shader, texture, attributes, bone_nodes, bone_offsets, index=None):
         self.shader = shader
 
         # setup shader attributes for linear blend skinning shader
         self.vertex_array = VertexArray(attributes, index)
 
-        # store skinning data
+        # store skinning data, offsets as one (n_bones, 4, 4) array
         self.bone_nodes = bone_nodes
-        self.bone_offsets = bone_offsets
+        self.bone_offsets = np.array(bone_offsets, np.float32).reshape(-1, 4, 4)
         self.texture = texture
-        
+
+        # the bone matrices are at consecutive locations from the first one
+        self.loc = {'boneMatrix': GL.glGetUniformLocation(shader.glid, 'boneMatrix[0]')}
+
+    def bone_palette(self):
+        """ Bone world transforms times their offsets, (n_bones, 4, 4) """
+        world = np.array([node.world_transform for node in self.bone_nodes], np.float32).reshape(-1, 4, 4)
+        return world @ self.bone_offsets
+
+    def state(self):
+        """ Program, diffuse texture and vertex array, as Mesh.state """
+        return self.shader.glid, self.texture.glid, self.vertex_array.glid
+
     def draw(self, projection, view, _model):
         """ Skinning object draw method """
-        shid = self.shader.glid
-        GL.glUseProgram(shid)
+        # bone world transform matrices of the current pose, as the bone
+        # nodes are posed again for each instance of the model
+        palette = self.bone_palette()[:MAX_BONES]
+        if self.queued and RenderQueue.current is not None:
+            RenderQueue.current.add(self, palette)
+        else:
+            RenderQueue.bind(self.state())
+            self.draw_item(palette)
 
-        # setup camera geometry parameters
-        loc = GL.glGetUniformLocation(shid, 'projection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection)
-        loc = GL.glGetUniformLocation(shid, 'view')
-        GL.glUniformMatrix4fv(loc, 1, True, view)
+    def draw_item(self, palette):
+        """ Upload the bone matrices in a single call and draw """
+        if len(palette):
+            GLState.uniform(GL.glUniformMatrix4fv, self.loc['boneMatrix'], len(palette), True, palette)
 
-        # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(GL.glGetUniformLocation(shid, 'diffuse_map'), 0)
+        # draw mesh vertex array
+        self.vertex_array.draw(GL.GL_TRIANGLES)
 
-        # bone world transform matrices need to be passed for skinning
-        for bone_id, node in enumerate(self.bone_nodes):
-            bone_matrix = node.world_transform @ self.bone_offsets[bone_id]
 
-            bone_loc = GL.glGetUniformLocation(shid, 'boneMatrix[%d]' % bone_id)
-            GL.glUniformMatrix4fv(bone_loc, 1, True, bone_matrix)
+class InstancedSkinnedMesh:
+    """ Skinned mesh drawn many times with a single instanced draw call, the
+        bone matrices of the animation being baked in a palette texture """
+    def __init__(self, shader, skinned_mesh, palette, duration):
+        self.shader = shader
+        self.texture = skinned_mesh.texture
+        self.duration = duration
 
-        # draw mesh vertex array
-        self.vertex_array.execute(GL.GL_TRIANGLES)
+        # per instance model matrix (locations 5 to 8) and animation time
+        # offset (location 9)
+        self.vertex_array = skinned_mesh.vertex_array
+        self.vertex_array.add_instance_attributes(5, (4, 4, 4, 4, 1))
+
+        # palette[frame, bone] matrices, stored as 4 columns texels per bone
+        frames, bones = palette.shape[:2]
+        self.palette = DataTexture(palette.transpose(0, 1, 3, 2).reshape(frames, 4 * bones, 4))
+
+        # the animation time is the scene time of the Frame block
+        names = ['model', 'diffuse_map', 'bone_palette', 'duration']
+        self.loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
+
+    def draw(self, projection, view, model, instance_matrices, time_offsets):
+        """ Draw one instance per model matrix, each one with its own
+            offset in the animation loop """
+        GLState.use_program(self.shader.glid)
+
+        GLState.uniform(GL.glUniformMatrix4fv, self.loc['model'], 1, True, model)
+        GLState.uniform(GL.glUniform1f, self.loc['duration'], self.duration)
+
+        # texture access setups
+        GLState.bind_texture(self.texture.glid, 0)
+        GLState.uniform(GL.glUniform1i, self.loc['diffuse_map'], 0)
+        GLState.bind_texture(self.palette.glid, 1)
+        GLState.uniform(GL.glUniform1i, self.loc['bone_palette'], 1)
 
-        # leave with clean OpenGL state, to make it easier to detect problems
-        GL.glUseProgram(0)
+        # GLSL matrix attributes are read column by column
+        instances = np.empty((len(instance_matrices), 17), np.float32)
+        instances[:, :16] = np.transpose(instance_matrices, (0, 2, 1)).reshape(-1, 16)
+        instances[:, 16] = time_offsets
+        self.vertex_array.execute_instanced(GL.GL_TRIANGLES, instances)
 
 
 
 # -------------- 3D resource loader -----------------------------------------
+def bounding_sphere(vertices):
+    """ Sphere centered on the bounding box of the vertices, holding them all """
+    vertices = np.asarray(vertices, np.float32)
+    center = (vertices.min(axis=0) + vertices.max(axis=0)) / 2
+    return center, float(np.linalg.norm(vertices - center, axis=1).max())
+
+
+def skinned_vertices(vertices, bone_ids, bone_weights, palette):
+    """ Vertices moved by the bone matrices of a pose, as by the skinning shader """
+    if not len(palette):
+        return np.asarray(vertices, np.float32)
+    skin = np.einsum('vb,vbij->vij', bone_weights, palette[bone_ids])
+    return (skin[:, :3, :3] @ np.asarray(vertices, np.float32)[..., None] + skin[:, :3, 3:])[..., 0]
+
+
 def load(file, shader, light_dir=(0, 0, 0), tex_file=None):
     """
     load a complex mesh
@@ -184,6 +244,10 @@ def load(file, shader, light_dir=(0, 0, 0), tex_file=None):
         if tex_file:
             mat.properties['diffuse_map'] = Texture(file=tex_file)
 
+    # shaders reading the waves, e.g. waterlily.vert, move the vertices by
+    # them, by any amount after set_waves: no box, such meshes are not culled
+    displaced = GL.glGetUniformBlockIndex(shader.glid, 'GerstnerWaves') != GL.GL_INVALID_INDEX
+
     # prepare textured mesh
     meshes = []
     for mesh in scene.mMeshes:
@@ -204,6 +268,8 @@ def load(file, shader, light_dir=(0, 0, 0), tex_file=None):
                              k_a=mat.get('COLOR_AMBIENT', (0, 0, 0)),
                              s=mat.get('SHININESS', 16.),
                              light_dir=light_dir)
+        mesh.bounds = bounding_sphere(attributes[0])
+        mesh.box = None if displaced else bounding_box(attributes[0])
 
         meshes.append(mesh)
 
@@ -265,6 +331,7 @@ def load_skinned(file, shader, tex_file=None):
     root_node = make_nodes(scene.mRootNode)
 
     # ---- create SkinnedMesh objects
+    skinning = []
     for mesh_id, mesh in enumerate(scene.mMeshes):
         # -- skinned mesh: weights given per bone => convert per vertex for GPU
         # first, populate an array with MAX_BONES entries per vertex
@@ -289,8 +356,57 @@ def load_skinned(file, shader, tex_file=None):
                            mesh.mFaces)
         for node in nodes_per_mesh_id[mesh_id]:
             node.add(mesh)
+        skinning.append((mesh, attrib[0], v_bone['id'], v_bone['weight']))
+
+    # ---- box of the skinned vertices over the animation, in the coordinates
+    # the root node is drawn with, see FrustumCulling
+    last_key = max((time for trs in transform_keyframes.values() for keys in trs for time in keys), default=0)
+    boxes = []
+    for time in np.linspace(0, last_key, SKINNED_BOX_POSES if last_key else 1):
+        root_node.pose(time)
+        boxes += [bounding_box(skinned_vertices(vertices, ids, weights, mesh.bone_palette()[:MAX_BONES]))
+                  for mesh, vertices, ids, weights in skinning]
+    root_node.box = union_box(boxes)
+    # the animation loops over its keys
+    for node in nodes.values():
+        node.duration = last_key
 
     nb_triangles = sum((mesh.mNumFaces for mesh in scene.mMeshes))
     # print('Loaded', file, '\t(%d meshes, %d faces, %d nodes, %d animations)' %
     #       (scene.mNumMeshes, nb_triangles, len(nodes), scene.mNumAnimations))
-    return [root_node]
\ No newline at end of file
+    return [root_node]
+
+
+def load_instanced(file, shader, tex_file=None, frames=32, duration=None):
+    """
+    load a skinned model once and bake its animation loop, sampled at
+    frames times, for instanced drawing; the loop lasts duration seconds,
+    the length of the animation keys by default
+    returns a list of InstancedSkinnedMesh
+    """
+    roots = load_skinned(file, shader, tex_file)
+    # a model without animation has any duration, all its poses being the same
+    duration = duration or max((root.duration for root in roots), default=0) or 1
+
+    def skinned_meshes(node):
+        """ Skinned meshes of the subtree """
+        meshes = []
+        for child in node.children.values():
+            if isinstance(child, SkinnedMesh):
+                meshes.append(child)
+            elif isinstance(child, Node):
+                meshes += skinned_meshes(child)
+        return meshes
+
+    meshes = [mesh for root in roots for mesh in skinned_meshes(root)]
+    palettes = [np.tile(identity(), (frames, max(1, len(mesh.bone_nodes)), 1, 1)) for mesh in meshes]
+    for frame in range(frames):
+        for root in roots:
+            root.pose(frame * duration / frames)
+        for mesh, palette in zip(meshes, palettes):
+            palette[frame, :len(mesh.bone_nodes)] = mesh.bone_palette()
+
+    instanced = [InstancedSkinnedMesh(shader, mesh, palette, duration) for mesh, palette in zip(meshes, palettes)]
+    for mesh in instanced:
+        mesh.box = union_box(root.box for root in roots)
+    return instanced
\ No newline at end of file
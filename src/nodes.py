@@ -9,6 +9,8 @@ from src.meshes import *
 
 class RotationControlNode(Node):
     """ Keyboard rotation control node """
+    animated = True
+
     def __init__(self, key_up, key_down, axis, angle=0):
         super().__init__()
         self.angle, self.axis = angle, axis
@@ -23,6 +25,8 @@ class RotationControlNode(Node):
 
 class KeyFrameControlNode(Node):
     """ Place node with transform keys above a controlled subtree """
+    animated = True
+
     def __init__(self, translate_keys, rotate_keys, scale_keys):
         super().__init__()
         self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
@@ -35,6 +39,11 @@ class KeyFrameControlNode(Node):
 
 class SkinningControlNode(Node):
     """ Place node with transform keys above a controlled subtree """
+    # the skinned meshes being placed by the bones, not by the nodes holding
+    # them, no box but the one load_skinned gives to the root
+    box = None
+    duration = 0    # of the animation loop, set by load_skinned
+
     def __init__(self, *keys, transform=identity()):
         super().__init__(transform=transform)
         self.keyframes = TransformKeyFrames(*keys) if keys[0] else None
@@ -43,11 +52,22 @@ class SkinningControlNode(Node):
     def draw(self, projection, view, model):
         """ When redraw requested, interpolate our node transform from keys """
         if self.keyframes:  # no keyframe update should happen if no keyframes
-            #time % 1.7 for the dolphin model, to loop on the animation
-            self.transform = self.keyframes.value(glfw.get_time() % 1.7)
+            # looping on the animation
+            now = glfw.get_time()
+            self.transform = self.keyframes.value(now % self.duration if self.duration else now)
 
         # store world transform for skinned meshes using this node as bone
         self.world_transform = model @ self.transform
 
         # default node behaviour (call children's draw method)
-        super().draw(projection, view, model)
\ No newline at end of file
+        super().draw(projection, view, model)
+
+    def pose(self, time, model=identity()):
+        """ Store the world transforms of the subtree at a given animation
+            time, without drawing anything """
+        if self.keyframes:
+            self.transform = self.keyframes.value(time)
+        self.world_transform = model @ self.transform
+        for child in self.children.values():
+            if isinstance(child, SkinningControlNode):
+                child.pose(time, self.world_transform)
\ No newline at end of file
@@ -3,13 +3,19 @@
 Python OpenGL practical application.
 """
 
-import copy
-import random
+import inspect
 import time
+import weakref
 
 from src.viewer import *
+from src.cache import *
 from src.meshes import *
 from src.nodes import *
+from src.ocean import *
+from src.flock import *
+from src.parallel import *
+from src.recording import *
+from src.terrain import *
 
 
 class Scene:
@@ -22,24 +28,66 @@ class Scene:
             'skybox': Shader(shaders_dir+"skybox.vert", shaders_dir+"skybox.frag"),
             'wave': Shader(shaders_dir+"waves.vert", shaders_dir+"waves.frag"),
             'skinning': Shader(shaders_dir+"skinning.vert", shaders_dir+"skinning.frag"),
-            'waterlily': Shader(shaders_dir+"waterlily.vert", shaders_dir+"color.frag")
+            'skinning_instanced': Shader(shaders_dir+"skinning_instanced.vert", shaders_dir+"skinning.frag"),
+            'waterlily': Shader(shaders_dir+"waterlily.vert", shaders_dir+"color.frag"),
+            'caustics': Shader(shaders_dir+"caustics.vert", shaders_dir+"caustics.frag")
         }
         self.node = Node()
         self.viewer.add(("root", self.node))
         self.light_dir = light_dir
         self.terrain = None
         self.water = None
-        self.begin = time.time()
-
-    def generate_terrain(self, texture, height, max_height, size, translation=0, caustics=None):
+        # scene time and light of the frames, shared by all the shaders
+        self.begin = self.viewer.frame.begin
+        self.viewer.frame.light_dir = vec(light_dir)
+        # obstacles avoided by the boids
+        self.environment = Environment()
+        # waves read by every water-aware shader, until generate_water sets them
+        self.wave_buffer = UniformBuffer('GerstnerWaves', wave_block(GERSTNER_WAVES))
+        # terrain and water arrays kept on disk from one run to the next
+        self.cache = ArrayCache()
+
+    def generate_terrain(self, texture, height, max_height, size, translation=0, caustics=None,
+                         caustics_quality='medium', displaced=False):
+        """ caustics_quality is a key of CAUSTICS_QUALITY, a displaced
+            terrain is raised on the GPU from its height map texture """
+        stage = None
+        if caustics is not None:
+            stage = Caustics(self.shaders['caustics'], self.light_dir, *CAUSTICS_QUALITY[caustics_quality])
         self.terrain = Terrain(texture, height, self.shaders['terrain'], max_height=max_height, translation=translation,
-                               size=size, light_dir=self.light_dir, caustics=caustics, begin_time=self.begin)
+                               size=size, caustics=caustics, begin_time=self.begin,
+                               caustics_stage=stage, displaced=displaced, cache=self.cache)
         self.viewer.add(("terrain", self.terrain))
+        self.environment.floor = self.terrain.heights
+
+    def generate_streaming_terrain(self, texture, height, spacing, translation=0, caustics=None,
+                                   caustics_quality='medium', **streaming):
+        """ height is a raw height map file written by save_heightmap or a
+            height source like ProceduralHeights, the streaming arguments go
+            to StreamingTerrain """
+        stage = None
+        if caustics is not None:
+            stage = Caustics(self.shaders['caustics'], self.light_dir, *CAUSTICS_QUALITY[caustics_quality])
+        self.terrain = StreamingTerrain(texture, height, self.shaders['terrain'], translation=translation,
+                                        spacing=spacing, caustics=caustics,
+                                        begin_time=self.begin, caustics_stage=stage, **streaming)
+        self.viewer.add(("terrain", self.terrain))
+        self.environment.floor = self.terrain.heights
 
-    def generate_water(self, texture, size):
-        self.water = Water(texture, self.shaders['wave'], size=size,
-                               light_dir=self.light_dir, begin_time=self.begin)
+    def generate_water(self, texture, size, waves=len(GERSTNER_WAVES), spectrum=None, **ocean):
+        """
+        waves is either a number of waves or an array of WAVE; with a
+        spectrum ('phillips' or 'jonswap'), the water is a SpectralOcean
+        made with the ocean arguments instead
+        """
+        if np.isscalar(waves):
+            waves = gerstner_waves(waves)
+        self.water = Water(texture, self.shaders['wave'], size=size, begin_time=self.begin,
+                               waves=waves, wave_buffer=self.wave_buffer,
+                               ocean=SpectralOcean(spectrum=spectrum, **ocean) if spectrum else None,
+                               cache=self.cache)
         self.viewer.add(("water", self.water)) 
+        self.environment.surface = self.water.heights
 
 
     def add(self, *objects, **animation):
@@ -49,9 +97,6 @@ class Scene:
         """
         for obj in objects:
             # check if the arguments have valid names
-            if not isinstance(obj, Boids):
-                for mesh in obj.mesh:
-                    mesh.begin = self.begin
             try:
                 names = ["rotation_control", "keyframes", "place_boids"]
                 for key in animation.keys():
@@ -80,6 +125,7 @@ class Scene:
                     else:
                         boid_rotation = identity()
                     transform = boid_position @ boid_rotation @ boid_scaling
+                obj.place(transform, self.environment)
                 new_node = Node(transform=transform)
                 new_node.add(("boids"+str(obj.index), obj))
                 self.node.add(("Boid"+str(obj.index), new_node))
@@ -98,6 +144,9 @@ class Scene:
                 keyframe = name + "_keyframe"
                 new_node = Node(transform=obj.transform)
                 new_node.add((tmp, obj))
+                # objects which do not move are obstacles for the boids
+                if not obj.rotation_control['rotation_control'] and not obj.keyframes['keyframes']:
+                    obj.add_obstacles(self.environment)
                 if obj.rotation_control['rotation_control']:
                     rotation_node = RotationControlNode(obj.rotation_control['key_up'], obj.rotation_control['key_down'],
                                                         obj.rotation_control['axis'], obj.rotation_control['angle'])
@@ -225,12 +274,23 @@ class Object:
                 else:
                     self.node.add((name, new_node))
 
+    def add_obstacles(self, environment):
+        """ Bounding spheres of the meshes, in world coordinates, become obstacles """
+        scaling = np.linalg.norm(self.transform[:3, :3], axis=0).max()
+        for mesh in self.mesh or []:
+            if getattr(mesh, 'bounds', None) is not None:
+                center, radius = mesh.bounds
+                environment.add_sphere((self.transform @ np.append(center, 1))[:3], scaling * radius)
+
+    @property
+    def box(self):
+        """ Box holding the meshes and the children objects, as Node.box """
+        return union_box([getattr(mesh, 'box', None) for mesh in self.mesh or []]
+                         + ([self.node.content_box()] if self.node.children else []))
+
     def draw(self, projection, view, model):
-        if self.mesh is not None:
-            for mesh in self.mesh:
-                mesh.draw(projection, view, model)
-        for node in self.node.children.values():
-            node.draw(projection, view, model)
+        """ Meshes and children objects in the view, see FrustumCulling """
+        FrustumCulling.draw(list(self.mesh or []) + list(self.node.children.values()), projection, view, model)
 
     def key_handler(self, key):
         """ Dispatch keyboard events to children """
@@ -240,10 +300,12 @@ class Object:
 
 
 class Surface(Mesh):
-    """ Generic surface """
-    def __init__(self, texture_map, max_height = 10, size = 50, light_dir=(0, 1, 0),
+    """ Generic surface, drawn at once with all its textures, lit by the
+        light of the Frame block, see FrameContext """
+    queued = False
+
+    def __init__(self, texture_map, max_height = 10, size = 50,
                  k_a=(0, 0, 0), k_d=(1, 1, 0), k_s=(0.1, 0.1, 0.1), s=16, caustics=None):
-        self.light_dir = light_dir
         self.k_a, self.k_d, self.k_s, self.s = k_a, k_d, k_s, s
 
         # interactive toggles
@@ -270,29 +332,21 @@ class Surface(Mesh):
 
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES, time=None, caustics=None):
         """ vérifier pour diffuse_map ? """
-        GL.glUseProgram(self.shader.glid)
+        GLState.use_program(self.shader.glid)
 
         # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(self.loc['diffuse_map'], 0)
-
-        # setup light parameters
-        GL.glUniform3fv(self.loc['light_dir'], 1, self.light_dir)
+        GLState.bind_texture(self.texture.glid, 0)
+        GLState.uniform(GL.glUniform1i, self.loc['diffuse_map'], 0)
 
-        # setup material parameters
-        GL.glUniform3fv(self.loc['k_a'], 1, self.k_a)
-        GL.glUniform3fv(self.loc['k_d'], 1, self.k_d)
-        GL.glUniform3fv(self.loc['k_s'], 1, self.k_s)
-        GL.glUniform1f(self.loc['s'], max(self.s, 0.001))
+        # setup material parameters, the light and camera being in the Frame block
+        GLState.uniform(GL.glUniform3fv, self.loc['k_a'], 1, self.k_a)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_d'], 1, self.k_d)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_s'], 1, self.k_s)
+        GLState.uniform(GL.glUniform1f, self.loc['s'], max(self.s, 0.001))
 
         if self.caustics is not None:
-            GL.glActiveTexture(GL.GL_TEXTURE1)
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.caustics.glid)
-            GL.glUniform1i(self.loc['caustics'], 1)
-        # world camera position for Phong illumination specular component
-        w_camera_position = np.linalg.inv(view)[:,3]
-        GL.glUniform3fv(self.loc['w_camera_position'], 1, w_camera_position)
+            GLState.bind_texture(self.caustics.glid, 1)
+            GLState.uniform(GL.glUniform1i, self.loc['caustics'], 1)
 
         super().draw(projection, view, model, primitives)
 
@@ -312,6 +366,25 @@ class TerrainAttributes(Attributes):
         height = Image.open(height_map).convert('L')
         # crop to a square height_map
         self.height_map = height.crop((0, 0, min(height.size), min(height.size)))
+        # same conversion as get_height, for all the pixels at once
+        heights = np.minimum(np.asarray(self.height_map, np.float64), self.max_color-1)
+        self.heights = (heights - self.max_color / 2) / self.max_color * self.max_height
+
+    def vertex_heights(self, rows, columns):
+        """ Heights of the vertices of index arrays, 0 outside the height map
+            as for the normals """
+        number_vertices_x = self.heights.shape[0]
+        inside = (rows >= 0) & (rows < number_vertices_x) & (columns >= 0) & (columns < number_vertices_x)
+        heights = self.heights[np.clip(rows, 0, number_vertices_x - 1), np.clip(columns, 0, number_vertices_x - 1)]
+        return np.where(inside, heights, 0) + self.translation
+
+    def surface(self, x, z):
+        """
+        Heights and normals of the terrain at the world positions (x, z),
+        given as arrays, bilinearly interpolated between the vertices
+        """
+        spacing = self.size / (self.heights.shape[0] - 1)
+        return bilinear_surface(self.vertex_heights, x, z, spacing, (-self.size / 2, -self.size / 2))
 
     def get_height(self, x, z):
         """
@@ -341,53 +414,33 @@ class TerrainAttributes(Attributes):
         normal = vec(height_left - height_right, 2, height_up - height_down)
         return normal / np.linalg.norm(normal)
 
-    def generate_attributes(self):
+    def generate_vertices(self):
         """
-        Generate the vertices, normals and indices to be
-        passed to the shader
+        Vertices and normals of the whole grid, for all the vertices at
+        once; the indices are the ones of the terrain chunks
         """
         # number of vertices along one axis
         number_vertices_x = self.height_map.size[0]
-        total_vertices = number_vertices_x**2
-        vertex_pointer = 0
-
-        # result containers
-        vertices = total_vertices * [0]
-        normals = total_vertices * [0]
 
-        # positions and normals computation
-        for i in range(number_vertices_x):
-            for j in range(number_vertices_x):
-                x = j / (number_vertices_x - 1) * self.size
-                y = self.get_height(j, i) + self.translation
-                z = i / (number_vertices_x - 1) * self.size
-                normal = self.compute_normal(j, i)
-
-                vertices[vertex_pointer] = (x, y, z)
-                normals[vertex_pointer] = normal
-                vertex_pointer += 1
+        # positions computation, rows of the height map along z
+        steps = np.arange(number_vertices_x) / (number_vertices_x - 1) * self.size
+        vertices = np.empty((number_vertices_x, number_vertices_x, 3))
+        vertices[..., 0] = steps[None, :]
+        vertices[..., 1] = self.heights + self.translation
+        vertices[..., 2] = steps[:, None]
 
         # centering the plane on (0, 0, 0)
-        vertices -= vec(self.size / 2, 0, self.size / 2)
-
-        # number of indices in the index array
-        indices = (6 * (number_vertices_x - 1)**2) * [0]
-        indices_pointer = 0
+        vertices = vertices.reshape(-1, 3) - vec(self.size / 2, 0, self.size / 2)
 
-        # indices computation
-        for z in range(number_vertices_x-1):
-            for x in range(number_vertices_x-1):
-                top_left = z * number_vertices_x + x
-                top_right = top_left + 1
-                bottom_left = (z + 1) * number_vertices_x + x
-                bottom_right = bottom_left + 1
+        # normals by central differences, the height being 0 outside the height map
+        heights = np.pad(self.heights, 1)
+        normals = np.empty((number_vertices_x, number_vertices_x, 3), np.float32)
+        normals[..., 0] = heights[1:-1, :-2] - heights[1:-1, 2:]
+        normals[..., 1] = 2
+        normals[..., 2] = heights[:-2, 1:-1] - heights[2:, 1:-1]
+        normals /= np.linalg.norm(normals, axis=2, keepdims=True)
 
-                ind = [top_left, bottom_left, top_right, top_right, bottom_left, bottom_right]
-                for i in range(6):
-                    indices[indices_pointer] = ind[i]
-                    indices_pointer += 1
-
-        return vertices, normals, indices
+        return vertices, normals.reshape(-1, 3)
 
 
 class WaterAttributes(Attributes):
@@ -395,67 +448,104 @@ class WaterAttributes(Attributes):
         super().__init__(texture_map, max_color, max_height, size)
 
 
-    def generate_attributes(self):
-        """
-        Generate the vertices, normals and indices to be
-        passed to the shader
-        """
-        # number of vertices along one axis
-        number_vertices_x = self.size
-        total_vertices = number_vertices_x**2
-        vertex_pointer = 0
-
-        # result containers
-        vertices = total_vertices * [0]
-        normals = total_vertices * [0]
-
-        # positions and normals computation
-        for i in range(number_vertices_x):
-            for j in range(number_vertices_x):
-                x = j / (number_vertices_x - 1) * self.size
-                y = 0
-                z = i / (number_vertices_x - 1) * self.size
-                normal = vec(0, 1, 0)
-
-                vertices[vertex_pointer] = (x, y, z)
-                normals[vertex_pointer] = normal
-                vertex_pointer += 1
-
-        # centering the plane on (0, 0, 0)
-        vertices -= vec(self.size / 2, 0, self.size / 2)
-
-        # number of indices in the index array
-        indices = (6 * (number_vertices_x - 1)**2) * [0]
-        indices_pointer = 0
-
-        # indices computation
-        for z in range(number_vertices_x-1):
-            for x in range(number_vertices_x-1):
-                top_left = z * number_vertices_x + x
-                top_right = top_left + 1
-                bottom_left = (z + 1) * number_vertices_x + x
-                bottom_right = bottom_left + 1
-
-                ind = [top_left, bottom_left, top_right, top_right, bottom_left, bottom_right]
-                for i in range(6):
-                    indices[indices_pointer] = ind[i]
-                    indices_pointer += 1
-
-        return vertices, normals, indices    
+# resolution of the wave field of the caustics and its updates per second,
+# 0 updating it every frame
+CAUSTICS_QUALITY = {'low': (128, 15), 'medium': (256, 30), 'high': (512, 0)}
+
+
+class Caustics:
+    """
+    Render stage of the waves seen from the sea floor: the height of the
+    surface and the shift of the caustics are rendered around the camera in
+    a low resolution texture, sampled by the terrain shader instead of
+    summing the waves for each of its fragments
+    """
+    def __init__(self, shader, light_dir, resolution=256, rate=0, extent=768):
+        self.shader, self.light_dir = shader, light_dir
+        self.resolution, self.extent = resolution, extent
+        self.period = 1 / rate if rate else 0
+        self.field = DataTexture(np.zeros((resolution, resolution, 4)), filter_mode=GL.GL_LINEAR)
+        self.frame_buffer = FrameBuffer(self.field, resolution, resolution)
+        self.triangle = VertexArray([])
+        self.origin, self.updated = np.zeros(2), -np.inf
+
+        names = ['field_origin', 'field_extent', 'light_dir', 'time']
+        self.loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
+
+    def update(self, camera, time):
+        """ Render the field around the camera (x, y, z) at the time, unless
+            it was rendered less than a period ago """
+        if time - self.updated < self.period:
+            return
+        self.updated = time
+        # snapped to the texels, the field does not shimmer when the camera moves
+        texel = self.extent / self.resolution
+        self.origin = np.rint(np.asarray(camera)[[0, 2]] / texel) * texel
+
+        GLState.use_program(self.shader.glid)
+        GLState.uniform(GL.glUniform2fv, self.loc['field_origin'], 1, self.origin)
+        GLState.uniform(GL.glUniform1f, self.loc['field_extent'], self.extent)
+        GLState.uniform(GL.glUniform3fv, self.loc['light_dir'], 1, self.light_dir)
+        GLState.uniform(GL.glUniform1f, self.loc['time'], time)
+        with self.frame_buffer:
+            GLState.bind_vertex_array(self.triangle.glid)
+            GL.glDrawArrays(GL.GL_TRIANGLES, 0, 3)
 
 
 class Terrain(Surface):
-    """ Simple first textured object """
+    """
+    Textured height map drawn by chunks of chunk_cells x chunk_cells squares:
+    the chunks out of the view are skipped and the others use one vertex
+    every 2**level, level growing by one every lod_distance (by default the
+    width of a chunk) away from the camera up to lod_levels - 1. A
+    displaced terrain only uploads its heights, as a texture, the vertices
+    and normals being made by terrain.vert from a flat grid. With an
+    ArrayCache, the chunk vertices, normals and bounding boxes of a height
+    map are only generated once and memory mapped afterwards
+    """
+    UNIFORMS = ['diffuse_map', 'k_a', 's', 'k_s', 'k_d', 'caustics',
+                'wave_field', 'field_origin', 'field_extent',
+                'displaced', 'height_field', 'chunk_cells', 'chunks_x', 'grid_spacing', 'grid_translation']
+
     def __init__(self, texture_map, height_map, shader, translation = 0, max_color = 256, max_height = 10, size = 50,
-                 light_dir=(0, 1, 0), k_a=(0, 0, 0), k_d=(1, 1, 0), k_s=(0.6, 0.6, 0.6), s=16, caustics=None, begin_time=None):
+                 k_a=(0, 0, 0), k_d=(1, 1, 0), k_s=(0.6, 0.6, 0.6), s=16, caustics=None, begin_time=None,
+                 caustics_stage=None, chunk_cells=64, lod_levels=4, lod_distance=None, displaced=False, cache=None):
         self.attrib = TerrainAttributes(texture_map, height_map, translation, max_color, max_height, size)
-        self.vertices, self.normals, self.indices = self.attrib.generate_attributes()
-
-        super().__init__(texture_map, max_height, size, light_dir, k_a, k_d, k_s, s, caustics)
-        Mesh.__init__(self, shader=shader, attributes=[self.vertices, self.normals], index=self.indices)
+        number_vertices_x = self.attrib.height_map.size[0]
+        lod_distance = lod_distance or size * chunk_cells / (number_vertices_x - 1)
+        self.displaced = displaced
+        if displaced:
+            self.vertices = self.normals = self.indices = None
+            self.chunks = TerrainChunks(None, number_vertices_x, chunk_cells, lod_levels, lod_distance)
+            self.chunks.set_heights(self.attrib.heights, size, translation)
+            attributes = []
+        else:
+            key = cache and cache.key(height_map, __file__, inspect.getfile(TerrainChunks), translation=translation,
+                                      max_color=max_color, max_height=max_height, size=size,
+                                      chunk_cells=chunk_cells, lod_levels=lod_levels)
+            arrays = cache and cache.load(key)
+            if arrays is None:
+                vertices, normals = self.attrib.generate_vertices()
+                self.chunks = TerrainChunks(vertices, number_vertices_x, chunk_cells, lod_levels, lod_distance)
+                arrays = dict(vertices=self.chunks.chunk_attributes(vertices).astype(np.float32),
+                              normals=self.chunks.chunk_attributes(normals).astype(np.float32),
+                              lower=self.chunks.lower, upper=self.chunks.upper)
+                if cache:
+                    cache.store(key, **arrays)
+            else:
+                self.chunks = TerrainChunks(None, number_vertices_x, chunk_cells, lod_levels, lod_distance)
+                self.chunks.set_bounds(np.array(arrays['lower']), np.array(arrays['upper']))
+            # chunk by chunk, as uploaded
+            self.vertices, self.normals, self.indices = arrays['vertices'], arrays['normals'], self.chunks.indices
+            attributes = [self.vertices, self.normals]
+
+        super().__init__(texture_map, max_height, size, k_a, k_d, k_s, s, caustics)
+        Mesh.__init__(self, shader=shader, index=self.chunks.indices, attributes=attributes)
+        if displaced:
+            self.height_field = DataTexture(self.attrib.heights)
         self.begin = begin_time
-        names = ['diffuse_map', 'light_dir', 'k_a', 's', 'k_s', 'k_d', 'w_camera_position', 'caustics', 'time']
-        loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
+        self.caustics_stage = caustics_stage
+        loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in self.UNIFORMS}
         self.loc.update(loc)
 
         # print('Loaded terrain \t(x=[%s, %s], z=[%s, %s], %s faces)' % (-self.attrib.size/2, self.attrib.size/2,
@@ -465,41 +555,136 @@ class Terrain(Surface):
     
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
         """ vérifier pour diffuse_map ? """
-        GL.glUseProgram(self.shader.glid)
+        camera = FrameContext.current.model_camera(model)
+        if self.caustics_stage is not None:
+            self.caustics_stage.update(camera, FrameContext.current.time)
 
-        # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(self.loc['diffuse_map'], 0)
+        # chunks in the view frustum, at the level of detail of their distance
+        planes = frustum_planes(projection @ view @ model)
+        self.vertex_array.set_multi_draw(*self.chunks.select(planes, camera))
 
-        # setup light parameters
-        GL.glUniform3fv(self.loc['light_dir'], 1, self.light_dir)
+        GLState.use_program(self.shader.glid)
+
+        # texture access setups
+        GLState.bind_texture(self.texture.glid, 0)
+        GLState.uniform(GL.glUniform1i, self.loc['diffuse_map'], 0)
 
         # setup material parameters
-        GL.glUniform3fv(self.loc['k_a'], 1, self.k_a)
-        GL.glUniform3fv(self.loc['k_d'], 1, self.k_d)
-        GL.glUniform3fv(self.loc['k_s'], 1, self.k_s)
-        GL.glUniform1f(self.loc['s'], max(self.s, 0.001))
-        timesup = time.time() - self.begin
-        GL.glUniform1f(self.loc['time'], timesup)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_a'], 1, self.k_a)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_d'], 1, self.k_d)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_s'], 1, self.k_s)
+        GLState.uniform(GL.glUniform1f, self.loc['s'], max(self.s, 0.001))
+
+        GLState.uniform(GL.glUniform1i, self.loc['displaced'], self.displaced)
+        if self.displaced:
+            GLState.bind_texture(self.height_field.glid, 3)
+            GLState.uniform(GL.glUniform1i, self.loc['height_field'], 3)
+            GLState.uniform(GL.glUniform1i, self.loc['chunk_cells'], self.chunks.cells)
+            GLState.uniform(GL.glUniform1i, self.loc['chunks_x'], self.chunks.number)
+            GLState.uniform(GL.glUniform1f, self.loc['grid_spacing'], self.attrib.size / (len(self.attrib.heights) - 1))
+            GLState.uniform(GL.glUniform1f, self.loc['grid_translation'], self.attrib.translation)
+
+        if self.caustics_stage is not None:
+            GLState.bind_texture(self.caustics_stage.field.glid, 2)
+            GLState.uniform(GL.glUniform1i, self.loc['wave_field'], 2)
+            GLState.uniform(GL.glUniform2fv, self.loc['field_origin'], 1, self.caustics_stage.origin)
+            GLState.uniform(GL.glUniform1f, self.loc['field_extent'], self.caustics_stage.extent)
+        else:   # waves computed by the shader
+            GLState.uniform(GL.glUniform1f, self.loc['field_extent'], 0)
+
+        super().draw(projection, view, model, primitives)
+
+    def surface(self, x, z):
+        """ Heights and normals of the terrain at the world positions (x, z),
+            given as arrays, e.g. to put objects on the floor """
+        return self.attrib.surface(x, z)
 
-        # world camera position for Phong illumination specular component
-        w_camera_position = np.linalg.inv(view)[:,3]
-        GL.glUniform3fv(self.loc['w_camera_position'], 1, w_camera_position)
+    def heights(self, x, z):
+        """ Heights of the terrain at the world positions (x, z) """
+        return self.surface(x, z)[0]
 
+    def update_heights(self, heights, row=0, column=0):
+        """
+        Replace the block of the height map starting at (row, column), rows
+        along z, of a displaced terrain: only this region of the texture and
+        the bounding boxes of the chunks it touches are updated
+        """
+        assert self.displaced, 'Only displaced terrains can be updated'
+        heights = np.asarray(heights, np.float64)
+        self.attrib.heights[row:row + heights.shape[0], column:column + heights.shape[1]] = heights
+        self.height_field.update(heights, column, row)
+        chunks = self.chunks.chunks_of(row, column, *heights.shape)
+        self.chunks.set_heights(self.attrib.heights, self.attrib.size, self.attrib.translation, chunks)
+
+
+class StreamingTerrain(Terrain):
+    """
+    Terrain read from a raw height map file (see save_heightmap) of any
+    size, or generated by an unbounded height source like ProceduralHeights,
+    spacing apart between samples: only the tiles within radius tiles of the
+    camera are made, by workers background threads, and at most
+    upload_budget of them are sent to the GPU per frame to avoid hitches
+    """
+    def __init__(self, texture_map, height_map, shader, translation=0, spacing=1,
+                 k_a=(0, 0, 0), k_d=(1, 1, 0), k_s=(0.6, 0.6, 0.6), s=16, caustics=None, begin_time=None,
+                 caustics_stage=None, chunk_cells=64, lod_levels=4, lod_distance=None, radius=3,
+                 cache_tiles=None, gpu_tiles=None, upload_budget=4, workers=1):
+        source = Heightmap(height_map) if isinstance(height_map, str) else height_map
+        self.chunks = TileStreamer(source, spacing, translation, chunk_cells, lod_levels,
+                                   lod_distance, radius, cache_tiles, gpu_tiles, upload_budget, workers)
+        # room for gpu_tiles tiles, filled as they come
+        empty = np.zeros((self.chunks.gpu_tiles * self.chunks.side**2, 3), np.float32)
+
+        Surface.__init__(self, texture_map, k_a=k_a, k_d=k_d, k_s=k_s, s=s, caustics=caustics)
+        Mesh.__init__(self, shader=shader, attributes=[empty, empty], index=IndexBuffer(self.chunks.indices),
+                      usage=GL.GL_DYNAMIC_DRAW)
+        self.begin = begin_time
+        self.caustics_stage = caustics_stage
+        self.displaced = False
+        loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in self.UNIFORMS}
+        self.loc.update(loc)
+
+    def surface(self, x, z):
+        """ Heights and normals of the terrain at the world positions (x, z),
+            interpolated between the samples of the loaded or not tiles """
+        return self.chunks.surface(x, z)
+
+    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        self.chunks.start()
+        for slot, vertices, normals in self.chunks.uploads(FrameContext.current.model_camera(model)):
+            self.vertex_array.update(0, vertices, slot * self.chunks.side**2)
+            self.vertex_array.update(1, normals, slot * self.chunks.side**2)
         super().draw(projection, view, model, primitives)
 
+
 class Water(Surface):
+    """
+    Water surface made of clipmap rings following the camera: the number of
+    vertices only depends on resolution, the spacing between vertices close
+    to the camera being spacing, and doubling from one ring to the next
+    """
+    blended = True      # alpha of waves.frag
+
     def __init__(self, texture_map, shader, max_color = 256, max_height = 100, size = 50,
-                 light_dir=(0, 1, 0), k_a=(0, 0, 0), k_d=(0, 0, 1), k_s=(1, 1, 1), s=10, begin_time=0):
+                 k_a=(0, 0, 0), k_d=(0, 0, 1), k_s=(1, 1, 1), s=10, begin_time=0,
+                 resolution=129, spacing=1, waves=GERSTNER_WAVES, wave_buffer=None, ocean=None, cache=None):
         self.attrib = WaterAttributes(texture_map, max_color, max_height, size)
-        self.vertices, self.normals, self.indices = self.attrib.generate_attributes()
+        self.clipmap = Clipmap(resolution, spacing, size / 2, cache)
+        self.vertices, self.indices = self.clipmap.vertices, self.clipmap.indices
+        self.normals = np.tile(vec(0, 1, 0), (len(self.vertices), 1))
         self.begin = begin_time
         self.size = size
-        super().__init__(texture_map, max_height, size, light_dir, k_a, k_d, k_s, s)
+        self.wave_buffer = wave_buffer or UniformBuffer('GerstnerWaves', wave_block(waves))
+        self.set_waves(waves)
+        # spectral ocean replacing the Gerstner waves, evaluated every frame
+        self.ocean = ocean
+        if ocean is not None:
+            self.ocean_textures = [DataTexture(data, GL.GL_REPEAT, GL.GL_LINEAR) for data in ocean.textures()]
+        super().__init__(texture_map, max_height, size, k_a, k_d, k_s, s)
         Mesh.__init__(self, shader=shader, attributes=[self.vertices, self.normals], index=self.indices)
 
-        names = ['diffuse_map', 'light_dir', 'k_a', 's', 'k_s', 'k_d', 'w_camera_position', 'time']
+        names = ['diffuse_map', 'k_a', 's', 'k_s', 'k_d', 'lod_spacing', 'lod_origin', 'lod_morph', 'lod_half_size',
+                 'spectral', 'ocean_displacement', 'ocean_normals', 'ocean_length']
         loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
         self.loc.update(loc)
 
@@ -507,190 +692,141 @@ class Water(Surface):
         #                                                                -self.attrib.size/2, self.attrib.size/2,
         #                                                                (self.size**2) * 2))
 
-    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        """ vérifier pour diffuse_map ? """
-        GL.glUseProgram(self.shader.glid)
+    def set_waves(self, waves):
+        """ Change the sea state, for the shaders and the CPU evaluation """
+        self.waves = np.asarray(waves, WAVE)
+        self.wave_buffer.update(wave_block(self.waves))
 
-        # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(self.loc['diffuse_map'], 0)
-
-        # setup light parameters
-        GL.glUniform3fv(self.loc['light_dir'], 1, self.light_dir)
-
-        # setup material parameters
-        GL.glUniform3fv(self.loc['k_a'], 1, self.k_a)
-        GL.glUniform3fv(self.loc['k_d'], 1, self.k_d)
-        GL.glUniform3fv(self.loc['k_s'], 1, self.k_s)
-        GL.glUniform1f(self.loc['s'], max(self.s, 0.001))
-        timesup = time.time() - self.begin
-        GL.glUniform1f(self.loc['time'], timesup)
-
-        # world camera position for Phong illumination specular component
-        w_camera_position = np.linalg.inv(view)[:,3]
-        GL.glUniform3fv(self.loc['w_camera_position'], 1, w_camera_position)
+    def surface(self, x, z, t=None):
+        """
+        Positions and normals of the water surface points at rest at (x, 0, z),
+        in model coordinates, at the scene time t (the one of the frame
+        drawn by default, see FrameContext); same values as the ones
+        computed by the shaders; the spectral ocean is interpolated in its
+        last evaluation unless t is given
+        """
+        if self.ocean is not None:
+            # evaluated aside, the last evaluation being the one drawn
+            return self.ocean.surface(x, z, None if t is None else self.ocean.snapshot(t))
+        if t is None:
+            frame = FrameContext.current
+            t = frame.time if frame is not None else time.time() - self.begin
+        return gerstner_wave(x, z, t, self.waves)
+
+    def heights(self, x, z):
+        """ Current height of the water surface above the points (x, z) """
+        return self.surface(x, z)[0][..., 1]
 
-        super().draw(projection, view, model, primitives)
+    def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        # translucent: drawn after the opaque meshes while a RenderQueue collects
+        Mesh.draw(self, projection, view, model, primitives)
 
+    def draw_item(self, projection, view, model, primitives=GL.GL_TRIANGLES):
+        """ vérifier pour diffuse_map ? """
+        GLState.use_program(self.shader.glid)
 
-class Boids:
+        # texture access setups
+        GLState.bind_texture(self.texture.glid, 0)
+        GLState.uniform(GL.glUniform1i, self.loc['diffuse_map'], 0)
+
+        # setup material parameters, the light, camera and time being in the
+        # Frame block
+        GLState.uniform(GL.glUniform3fv, self.loc['k_a'], 1, self.k_a)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_d'], 1, self.k_d)
+        GLState.uniform(GL.glUniform3fv, self.loc['k_s'], 1, self.k_s)
+        GLState.uniform(GL.glUniform1f, self.loc['s'], max(self.s, 0.001))
+
+        GLState.uniform(GL.glUniformMatrix4fv, self.loc['model'], 1, True, model)
+        self.wave_buffer.bind()
+
+        GLState.uniform(GL.glUniform1i, self.loc['spectral'], self.ocean is not None)
+        if self.ocean is not None:
+            self.ocean.evaluate(FrameContext.current.time)
+            for unit, (name, texture, data) in enumerate(zip(['ocean_displacement', 'ocean_normals'],
+                                                             self.ocean_textures, self.ocean.textures()), 1):
+                GLState.active_texture(unit)
+                texture.update(data)
+                GLState.uniform(GL.glUniform1i, self.loc[name], unit)
+            GLState.uniform(GL.glUniform1f, self.loc['ocean_length'], self.ocean.length)
+
+        # one draw call per ring, centered on the camera in model coordinates
+        GLState.uniform(GL.glUniform1f, self.loc['lod_half_size'], self.clipmap.center)
+        camera = FrameContext.current.model_camera(model)
+        for spacing, origin, (first, count), morph in self.clipmap.placements(camera):
+            GLState.uniform(GL.glUniform1f, self.loc['lod_spacing'], spacing)
+            GLState.uniform(GL.glUniform2fv, self.loc['lod_origin'], 1, origin)
+            GLState.uniform(GL.glUniform1f, self.loc['lod_morph'], morph)
+            self.vertex_array.execute_range(primitives, first, count)
+
+
+class Boids(Flock):
     """ Boids model """
-    def __init__(self, shader, number, model, scaling, index, tex_file=None):
-        """ For now, number has to be a perfect cube """
+    def __init__(self, shader, number, model, scaling, index, tex_file=None, tick_rate=60, workers=None,
+                 instanced=False, record=None, replay=None):
+        """
+        If instanced, the model is loaded once and the whole flock is drawn
+        with one draw call per mesh; shader has to be 'skinning_instanced'
+        The run is saved to the file record, or the one saved in the file
+        replay is played back instead of simulating the flock
+        """
+        super().__init__(number)
         self.index = index      # used in Scene.add
-        self.number = number
-        self.positions = []
-        self.boids = []
-        self.perception = 2
-        self.deltat = 1e-1
-        self.max_speed = 2
-        self.max_force = 5
-
-        n = round(number ** (1./3))
-
-        for i in range(n):
-            for j in range(n):
-                for k in range(n):
-                    # positioning and centering the cluster
-                    self.positions.append(3 * vec(i - (n-1) / 2, j - (n-1) / 2, k - (n-1) / 2))
-                    
-        self.velocities = [vec(random.uniform(0, np.sqrt(3*self.max_speed**2)),
-                               random.uniform(0, np.sqrt(3*self.max_speed**2)),
-                               random.uniform(0, np.sqrt(3*self.max_speed**2))) for _ in range(number)]
-        self.accelerations = [vec(random.uniform(0, np.sqrt(3*self.max_force**2)),
-                                  random.uniform(0, np.sqrt(3*self.max_force**2)),
-                                  random.uniform(0, np.sqrt(3*self.max_force**2))) for _ in range(number)]
-
-        self.orientations = [velocity / np.linalg.norm(velocity) for velocity in self.velocities]     # to change the orientation of the boids
-
-
-        roots = []
-        for i in range(number):
-            # To be able to rotate the boids in their own spatial system
-            roots.append(Object(shader, "root_{}".format(i), position=self.positions[i], scaling=(scaling, scaling, scaling)))
-
-            # Setting the correct orientation at the beginning
-            axis = np.cross(vec(0, 0, 1), self.orientations[i])
-            angle =  np.arccos(np.dot(vec(0, 0, 1), self.orientations[i])) * 360 / (2 * np.pi)
-            rotation_mat = rotate(self.orientations[i], 180) @ rotate(axis, angle) @ rotate(vec(0, 0, 1), 180)
-            roots[i].add(Object(shader, "boid_{}".format(i), model, rotation_mat=rotation_mat, tex_file=tex_file, animated=True))
-
-            self.boids.append(roots[i])
-
-    def edges(self):
-        """ If the boids hit an edge of the box, its velocity along this axis is inverted and so is the acceleration """
-        indices = [i for i in range(self.number)]
-        for index, boid, position, orientation, velocity, acceleration in zip(indices, self.boids, self.positions, self.orientations, self.velocities, self.accelerations):
-            new_orientation = copy.deepcopy(orientation)
-            changed = False
-            for i in range(3):
-                if (position[i] > 10 and velocity[i] > 0) or (position[i] < -10 and velocity[i] < 0):
-                    velocity[i] = -velocity[i]
-                    acceleration[i] = -acceleration[i]
-                    new_orientation[i] = -orientation[i]
-                    changed = True 
-                    
-            # Changing the orientation of the objects if needed
-            if changed:
-                # Rotation in the boid's ref and not in the common one
-                axis = np.cross(orientation, new_orientation)
-                # Angle changed from radians to degrees
-                angle = np.arccos(np.dot(orientation, new_orientation)) * 360 / (2 * np.pi)
-                # Rotations of 180 degrees to preserve the up vector of the boid
-                rotation_mat = rotate(new_orientation, 180) @ rotate(axis, angle) @ rotate(orientation, 180)
-
-                for child in boid.node.children.values():
-                    child.transform = rotation_mat @ child.transform
-
-            # Updating the orientations
-            self.orientations[index] = copy.deepcopy(new_orientation)
-
-    def alignement(self):
-        """ Alignement of the orientation of a boid """
-        for index in range(self.number):
-            direction = vec(0, 0, 0)
-            average = vec(0, 0, 0)
-            total = 0
-            for other_index in range(self.number):
-                # if the boids are different and can perceive each other
-                if index != other_index and np.linalg.norm(self.positions[index] - self.positions[other_index]) < self.perception:
-                    average += self.velocities[other_index]
-                    total += 1
-            if total > 0:
-                average /= total
-                average = average / np.linalg.norm(average) * self.max_speed
-                direction = average - self.velocities[index]
-                self.accelerations[index] += direction
-
-    def cohesion(self):
-        """ Cohesion rule """
-        for index in range(self.number):
-            direction = vec(0, 0, 0)
-            center_of_mass = vec(0, 0, 0)
-            total = 0
-            for other_index in range(self.number):
-                # if the boids are different and can perceive each other
-                if index != other_index and np.linalg.norm(self.positions[index] - self.positions[other_index]) < self.perception:
-                    center_of_mass += self.positions[other_index]
-                    total += 1
-            if total > 0:
-                center_of_mass /= total
-                vector_to_center = center_of_mass - self.positions[index]
-                if np.linalg.norm(vector_to_center) > 0:
-                    vector_to_center = vector_to_center / np.linalg.norm(vector_to_center) * self.max_speed
-                direction = vector_to_center - self.velocities[index]
-                # a maximal force intensity is imposed in the parameters and checked here
-                if np.linalg.norm(direction) > self.max_force:
-                    direction = direction /np.linalg.norm(direction) * self.max_force
-                self.accelerations[index] += self.deltat * direction
-
-    def separation(self):
-        """ Separation rule """
-        for index in range(self.number):
-            direction = vec(0, 0, 0)
-            average = vec(0, 0, 0)
-            total = 0
-            for other_index in range(self.number):
-                distance = np.linalg.norm(self.positions[other_index] - self.positions[index])
-                # if the boids are different and perceive each other
-                if index != other_index and distance < self.perception:
-                    diff_vector = self.positions[index] - self.positions[other_index]
-                    # normalization
-                    diff_vector /= distance
-                    average += diff_vector
-                    total += 1
-            if total > 0:
-                average /= total
-                direction = average - self.velocities[index]
-                # a maximal force intensity is imposed in the parameters and checked here
-                if np.linalg.norm(direction) > self.max_force:
-                    direction = direction / np.linalg.norm(direction) * self.max_force
-                self.accelerations[index] += self.deltat * direction
-
-    def update_positions(self):
-        self.edges()
-        indices = [i for i in range(self.number)]
-        for index, boid, velocity, acceleration in zip(indices, self.boids, self.velocities, self.accelerations):
-            boid.transform = translate(self.deltat*velocity) @ boid.transform
-            self.positions[index] += self.deltat * velocity
-            velocity += acceleration * self.deltat
-            # max speed
-            if np.linalg.norm(velocity) > self.max_speed:
-                velocity /= np.linalg.norm(velocity) * self.max_speed
-            self.velocities[index] = velocity
+        self.scaling = scaling
+
+        # the orientation of every boid is given by its model matrix
+        if instanced:
+            self.meshes = load_instanced(model, shader, tex_file)
+            self.time_offsets = np.random.uniform(0, self.meshes[0].duration if self.meshes else 0, number)
+            self.boids = []
+        else:
+            self.meshes = None
+            self.boids = [Object(shader, "boid_{}".format(i), model, tex_file=tex_file, animated=True)
+                          for i in range(number)]
+
+        # the simulation runs at a fixed rate, independently of the frame rate,
+        # optionally spread over several worker processes
+        if replay is not None:
+            self.simulation = None
+            self.scheduler = FlockReplay(replay)
+            assert self.scheduler.number == number, 'Recording of %d boids' % self.scheduler.number
+        else:
+            self.simulation = ParallelFlock(self, workers) if workers else self
+            recorder = FlockRecorder(record, number, 1 / tick_rate) if record is not None else None
+            self.scheduler = FlockScheduler(self.simulation, tick_rate, recorder=recorder)
+            # the thread is stopped by close, or at exit at the latest, before
+            # the workers it steps, the later finalizers running first
+            weakref.finalize(self, self.scheduler.stop)
+
+    def place(self, frame, environment):
+        """ Flock to world matrix and obstacles, of the parallel simulation
+            too """
+        self.frame, self.environment = frame, environment
+        if self.simulation is not None and self.simulation is not self:
+            self.simulation.frame, self.simulation.environment = frame, environment
+
+    def close(self):
+        """ Stop the simulation thread, then the worker processes if any """
+        self.scheduler.stop()
+        if self.simulation is not None and self.simulation is not self:
+            self.simulation.close()
 
     def draw(self, projection, view, model):
-        self.alignement()
-        self.cohesion()
-        self.separation()
-        self.update_positions()
-        for boid in self.boids:
-            boid.draw(projection, view, model @ boid.transform)
+        self.scheduler.start()
+        transforms = self.scheduler.model_matrices(self.scaling)
+        # the boids out of the view are left out of the draw
+        if self.meshes is not None:
+            for mesh in self.meshes:
+                shown = FrustumCulling.instances(mesh.box, projection @ view @ model, transforms)
+                if shown.any():
+                    mesh.draw(projection, view, model, transforms[shown], self.time_offsets[shown])
+        for boid, transform in zip(self.boids, transforms):
+            FrustumCulling.draw([boid], projection, view, model @ transform)
 
 
 class Skybox(Mesh):
     """ Loading and drawing a skybox, to draw at the end of the scene """
+    queued = False
+
     def __init__(self, shader, *texture_paths):
         assert len(texture_paths) == 6, 'Wrong number of textures'
         self.textures = []
@@ -700,8 +836,7 @@ class Skybox(Mesh):
 
         # Loading the cube map
         self.cube_map_id = GL.glGenTextures(1)
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, self.cube_map_id)
+        GLState.bind_texture(self.cube_map_id, 0, GL.GL_TEXTURE_CUBE_MAP)
 
         for index, texture in enumerate(self.textures):
             # Right, Left, Top, Bottom, Front, Back faces
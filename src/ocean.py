@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Ocean surface helpers, independent of any OpenGL state
+"""
+
+import numpy as np
+
+# Gerstner waves of the water, as in the GerstnerWave struct of the shaders:
+# the directions are not normalized, their norm scales the wave number
+WAVE = np.dtype([('direction', np.float32, 2), ('amplitude', np.float32), ('steepness', np.float32),
+                 ('frequency', np.float32), ('speed', np.float32)])
+GERSTNER_WAVES = np.array([((0., 1.), 1.8, 0.2, 0.07, 0.5),
+                           ((1., 0.), 2.5, 0.1, 0.02, 0.2),
+                           ((-1, 0.7), 0.8, 0.5, 0.09, 0.4),
+                           ((3., -4.), 1.2, 0.3, 0.04, 0.3)], WAVE)
+
+# std140 layout of the GerstnerWaves uniform block: the wave count, padded
+# to 16 bytes, then an array of MAX_WAVES structs of 32 bytes
+MAX_WAVES = 16
+WAVE_STD140 = np.dtype({'names': WAVE.names, 'formats': [WAVE[name] for name in WAVE.names],
+                        'offsets': [0, 8, 12, 16, 20], 'itemsize': 32})
+
+
+def gerstner_waves(number, seed=0):
+    """
+    Set of number waves: the ones of GERSTNER_WAVES, completed by random
+    waves shorter and lower than them
+    """
+    extra = max(0, number - len(GERSTNER_WAVES))
+    rng = np.random.default_rng(seed)
+    waves = np.zeros(extra, WAVE)
+    angles = rng.uniform(0, 2 * np.pi, extra)
+    waves['direction'] = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    waves['frequency'] = rng.uniform(0.1, 0.3, extra)
+    waves['amplitude'] = rng.uniform(0.01, 0.03, extra) / waves['frequency']
+    waves['steepness'] = rng.uniform(0.1, 0.5, extra)
+    waves['speed'] = rng.uniform(0.2, 0.6, extra)
+    return np.concatenate([GERSTNER_WAVES[:number], waves])
+
+
+def wave_block(waves):
+    """ Content of the GerstnerWaves uniform block for a set of waves """
+    assert len(waves) <= MAX_WAVES, 'at most %d waves' % MAX_WAVES
+    block = np.zeros(16 + MAX_WAVES * WAVE_STD140.itemsize, np.uint8)
+    block[:4] = np.array([len(waves)], np.int32).view(np.uint8)
+    block[16:].view(WAVE_STD140)[:len(waves)] = waves
+    return block
+
+
+def _phases(x, z, t, waves):
+    """ Phase of every wave at every point, waves along the last axis """
+    x, z, t = (np.asarray(a, np.float64)[..., None] for a in (x, z, t))
+    direction = waves['direction'].astype(np.float64)
+    return (x * direction[:, 0] + z * direction[:, 1]) * waves['frequency'] + t * waves['speed']
+
+
+def gerstner_position(x, z, t, waves=GERSTNER_WAVES):
+    """
+    Position of the surface point at rest at (x, 0, z) at the time t, as
+    gerstner_wave_position of the shaders; x, z, t are broadcast together
+    and the positions are returned along a last axis of size 3
+    """
+    theta = _phases(x, z, t, waves)
+    width = waves['steepness'] * waves['amplitude'] * np.cos(theta)
+    direction = waves['direction'].astype(np.float64)
+    return np.stack([np.asarray(x, np.float64) + width @ direction[:, 0],
+                     np.sin(theta) @ waves['amplitude'].astype(np.float64),
+                     np.asarray(z, np.float64) + width @ direction[:, 1]], axis=-1)
+
+
+def gerstner_normal(x, z, t, waves=GERSTNER_WAVES):
+    """ Unnormalized normal at (x, z) at the time t, as gerstner_wave_normal
+        of the shaders, along a last axis of size 3 """
+    psi = _phases(x, z, t, waves)
+    af = waves['amplitude'].astype(np.float64) * waves['frequency']
+    omega = af * np.cos(psi)
+    direction = waves['direction'].astype(np.float64)
+    return np.stack([-omega @ direction[:, 0],
+                     1 - (af * np.sin(psi)) @ waves['steepness'].astype(np.float64),
+                     -omega @ direction[:, 1]], axis=-1)
+
+
+def gerstner_wave(x, z, t, waves=GERSTNER_WAVES):
+    """
+    Positions and normals of the surface points at rest at (x, 0, z), the
+    normals being evaluated at the displaced positions, as gerstner_wave of
+    the shaders
+    """
+    positions = gerstner_position(x, z, t, waves)
+    return positions, gerstner_normal(positions[..., 0], positions[..., 2], t, waves)
+
+
+class Clipmap:
+    """
+    Concentric square levels of detail following the camera: level k is a
+    resolution x resolution grid with a spacing of spacing * 2**k, snapped
+    to the grid of level k+1, with a hole where level k-1 lies; with an
+    ArrayCache, the vertices and index sets are memory mapped once made
+    """
+    def __init__(self, resolution=129, spacing=1, extent=500, cache=None):
+        assert (resolution - 1) % 4 == 0, 'resolution has to be 4n+1'
+        self.resolution, self.spacing = resolution, spacing
+        self.center = (resolution - 1) // 2     # index of the central vertex
+        # enough levels for the last one to reach extent around the camera
+        self.levels = 1
+        while self.center * spacing * 2**(self.levels - 1) < extent:
+            self.levels += 1
+        key = cache and cache.key(__file__, resolution=resolution, spacing=spacing, extent=extent)
+        arrays = cache and cache.load(key)
+        if arrays is None:
+            indices, ranges = self._indices()
+            arrays = dict(vertices=self._vertices(), indices=indices, ranges=np.array(ranges))
+            if cache:
+                cache.store(key, **arrays)
+        self.vertices, self.indices = arrays['vertices'], arrays['indices']
+        self.ranges = [tuple(indices) for indices in arrays['ranges'].tolist()]
+
+    def _vertices(self):
+        """ Grid coordinates (i, 0, j) relative to the central vertex """
+        steps = np.arange(self.resolution) - self.center
+        vertices = np.zeros((self.resolution, self.resolution, 3), np.float32)
+        vertices[..., 0] = steps[None, :]
+        vertices[..., 2] = steps[:, None]
+        return vertices.reshape(-1, 3)
+
+    def _indices(self):
+        """
+        Index sets of the full grid, then of the grid with a hole at each of
+        the 4 possible positions of the finer level, concatenated in one
+        array with the (first, count) range of each set
+        """
+        cells = self.resolution - 1
+        top_left = (np.arange(cells)[None, :] + self.resolution * np.arange(cells)[:, None]).ravel()
+        quads = np.stack([top_left, top_left + self.resolution, top_left + 1,
+                          top_left + 1, top_left + self.resolution, top_left + self.resolution + 1], axis=1)
+        column, row = top_left % self.resolution, top_left // self.resolution
+
+        half = self.center // 2     # half size of the finer level, in cells
+        sets = [quads]
+        for shift_z in (0, 1):
+            for shift_x in (0, 1):
+                hole = (column >= self.center + shift_x - half) & (column < self.center + shift_x + half) & \
+                       (row >= self.center + shift_z - half) & (row < self.center + shift_z + half)
+                sets.append(quads[~hole])
+        counts = [indices.size for indices in sets]
+        firsts = np.cumsum([0] + counts[:-1])
+        return np.concatenate([indices.ravel() for indices in sets]), list(zip(firsts, counts))
+
+    def placements(self, camera):
+        """
+        For each level, its spacing, the world (x, z) of its central vertex,
+        the (first, count) range of its indices and whether it morphs into
+        the next level at its border
+        """
+        camera = np.asarray(camera, np.float64)[[0, 2]]
+        placements, finer = [], None
+        for level in range(self.levels):
+            spacing = self.spacing * 2**level
+            origin = np.floor(camera / (2 * spacing)) * 2 * spacing
+            if finer is None:
+                indices = self.ranges[0]
+            else:
+                shift_x, shift_z = np.rint((finer - origin) / spacing).astype(int)
+                indices = self.ranges[1 + shift_x + 2 * shift_z]
+            placements.append((spacing, origin, indices, level < self.levels - 1))
+            finer = origin
+        return placements
+
+
+GRAVITY = 9.81
+
+
+class SpectralOcean:
+    """
+    Tiling ocean patch of length x length world units, sum of resolution**2
+    waves drawn from a Phillips or JONSWAP spectrum and evaluated at any
+    time with inverse FFTs, at a cost independent of the number of waves
+    """
+    def __init__(self, resolution=256, length=256, wind=(10, 0), spectrum='phillips',
+                 amplitude=1, choppiness=1, fetch=100e3, seed=0):
+        self.resolution, self.length, self.choppiness = resolution, length, choppiness
+        # wave vectors, in the order of the FFT outputs: x along columns, z along rows
+        k = 2 * np.pi * np.fft.fftfreq(resolution, length / resolution)
+        self.kx, self.kz = np.meshgrid(k, k)
+        self.k = np.hypot(self.kx, self.kz)
+        k = np.where(self.k > 0, self.k, 1)     # no division by 0 for the constant term
+        self.omega = np.sqrt(GRAVITY * self.k)
+
+        speed = np.linalg.norm(wind)
+        cosine = (self.kx * wind[0] + self.kz * wind[1]) / (k * speed)
+        spectra = {'phillips': self._phillips, 'jonswap': self._jonswap}
+        energy = amplitude * spectra[spectrum](k, cosine, speed, fetch) * (2 * np.pi / length)**2
+        # no constant term, nor Nyquist terms which have no opposite wave
+        energy[0, 0] = energy[resolution // 2, :] = energy[:, resolution // 2] = 0
+        rng = np.random.default_rng(seed)
+        self.h0 = (rng.standard_normal(k.shape) + 1j * rng.standard_normal(k.shape)) * np.sqrt(energy / 2)
+        # conjugate of the amplitude of the opposite wave vector
+        self.h0_opposite = np.conj(np.roll(self.h0[::-1, ::-1], 1, axis=(0, 1)))
+
+        # (positions, normals) of the last evaluation, replaced as a whole so
+        # that other threads, e.g. the boids worker, never read a half update
+        self.evaluation = np.zeros((resolution, resolution, 3)), np.tile([0., 1., 0.], (resolution, resolution, 1))
+
+    def _phillips(self, k, cosine, speed, fetch):
+        """ Phillips spectrum, waves longer than 1/1000 of the largest one """
+        largest = speed**2 / GRAVITY
+        return np.exp(-1 / (k * largest)**2 - (k * largest / 1000)**2) / k**4 * cosine**2 * 1e-3
+
+    def _jonswap(self, k, cosine, speed, fetch):
+        """ JONSWAP spectrum of a sea developed over fetch meters, with a
+            cos^2 spreading around the wind """
+        omega = np.sqrt(GRAVITY * k)
+        peak = 22 * (GRAVITY**2 / (speed * fetch))**(1 / 3)
+        alpha = 0.076 * (speed**2 / (fetch * GRAVITY))**0.22
+        sigma = np.where(omega <= peak, 0.07, 0.09)
+        peakedness = 3.3**np.exp(-(omega - peak)**2 / (2 * sigma**2 * peak**2))
+        frequency = alpha * GRAVITY**2 / omega**5 * np.exp(-1.25 * (peak / omega)**4) * peakedness
+        spreading = 2 / np.pi * np.where(cosine > 0, cosine**2, 0)
+        # S(omega) d omega d theta = P(k) k dk d theta
+        return frequency * GRAVITY / (2 * omega) * spreading / k
+
+    @property
+    def positions(self):
+        """ Grid point positions of the last evaluation """
+        return self.evaluation[0]
+
+    @property
+    def normals(self):
+        """ Grid point normals of the last evaluation """
+        return self.evaluation[1]
+
+    def evaluate(self, t):
+        """ Evaluate at the time t and keep it as the last evaluation """
+        self.evaluation = self.snapshot(t)
+        return self.evaluation
+
+    def snapshot(self, t):
+        """
+        Positions (displacement added to the rest position) and normals of
+        the resolution x resolution grid points at the time t, the grid
+        point (i, j) resting at (j, i) * length / resolution; the last
+        evaluation is left untouched
+        """
+        phase = np.exp(1j * self.omega * t)
+        h = self.h0 * phase + self.h0_opposite / phase
+        k = np.where(self.k > 0, self.k, 1)
+        displacement_x, displacement_z = -1j * self.kx / k * h, -1j * self.kz / k * h
+        slope_x, slope_z = 1j * self.kx * h, 1j * self.kz * h
+
+        # the fields are real, two of them go through each complex inverse FFT
+        fields = np.fft.ifft2(np.stack([h + 1j * displacement_x, displacement_z + 1j * slope_x, slope_z]))
+        fields *= self.resolution**2
+        steps = np.arange(self.resolution) * self.length / self.resolution
+        positions = np.stack([steps[None, :] + self.choppiness * fields[0].imag,
+                              fields[0].real,
+                              steps[:, None] + self.choppiness * fields[1].real], axis=-1)
+        normals = np.stack([-fields[1].imag, np.ones_like(fields[2].real), -fields[2].real], axis=-1)
+        return positions, normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+
+    def textures(self, evaluation=None):
+        """ Displacements and normals of an evaluation, the last one by
+            default, as RGBA texture data tiling the patch """
+        positions, normals = evaluation or self.evaluation
+        steps = np.arange(self.resolution) * self.length / self.resolution
+        displacements = positions - np.stack(np.broadcast_arrays(steps[None, :], 0, steps[:, None]), axis=-1)
+        pad = np.zeros(displacements.shape[:2] + (1,))
+        return np.concatenate([displacements, pad], axis=-1), np.concatenate([normals, pad], axis=-1)
+
+    def surface(self, x, z, evaluation=None):
+        """
+        Positions and normals of an evaluation, the last one by default, at
+        the points at rest at (x, 0, z), interpolated bilinearly in the
+        tiling patch
+        """
+        x, z = np.broadcast_arrays(np.asarray(x, np.float64), np.asarray(z, np.float64))
+        u, v = x / self.length * self.resolution, z / self.length * self.resolution
+        j, i = np.floor(u).astype(int), np.floor(v).astype(int)
+        fu, fv = (u - j)[..., None], (v - i)[..., None]
+        displacements, normals = self.textures(evaluation)
+        result = []
+        for field in (displacements[..., :3], normals[..., :3]):
+            def texel(di, dj):
+                return field[(i + di) % self.resolution, (j + dj) % self.resolution]
+            result.append((1 - fv) * ((1 - fu) * texel(0, 0) + fu * texel(0, 1)) +
+                          fv * ((1 - fu) * texel(1, 0) + fu * texel(1, 1)))
+        positions, normals = result
+        positions += np.stack([x, np.zeros_like(x), z], axis=-1)
+        return positions, normals / np.linalg.norm(normals, axis=-1, keepdims=True)
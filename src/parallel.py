@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Boids simulation spread over several processes sharing the flock state
+"""
+
+import multiprocessing as mp
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.flock import *
+
+FIELDS = ('positions', 'velocities', 'accelerations', 'orientations')
+
+
+def _attach(name, shape, dtype):
+    """ Shared memory block and the numpy array viewing it """
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype, buffer=block.buf)
+
+
+def _worker(rank, names, number, workers, parameters, barrier, stopped):
+    """
+    Worker process owning the slab bounds[rank] <= x < bounds[rank+1]:
+    the boids of the slab and of its halo (one perception radius wide) are
+    simulated, only the ones of the slab are written back
+    """
+    state_block, state = _attach(names[0], (2, len(FIELDS), number, 3), np.float32)
+    control_block, control = _attach(names[1], (workers + 2,), np.float64)
+    local = Flock(0, **parameters)
+    try:
+        while True:
+            barrier.wait()
+            if stopped.is_set():
+                break
+            current = int(control[0])
+            lo, hi = control[1 + rank], control[2 + rank]
+            x = state[current, 0, :, 0]
+            halo = np.nonzero((x >= lo - local.perception) & (x < hi + local.perception))[0]
+            owned = (x[halo] >= lo) & (x[halo] < hi)
+            local.number = len(halo)
+            local.positions, local.velocities, local.accelerations, local.orientations = state[current][:, halo]
+            local.step()
+
+            for field, values in enumerate((local.positions, local.velocities, local.accelerations, local.orientations)):
+                state[1 - current, field, halo[owned]] = values[owned]
+            barrier.wait()
+    except threading.BrokenBarrierError:
+        pass    # released without waiting for a step, see _release
+    del state, control
+    state_block.close()
+    control_block.close()
+
+
+def _release(processes, blocks, arrays, barrier, stopped, timeout):
+    """
+    Stop the workers and free the shared memory: the workers are only met
+    at the barrier if they are all alive, e.g. not at exit once
+    multiprocessing killed them, and the ones not done after timeout
+    seconds are terminated
+    """
+    stopped.set()
+    if all(process.is_alive() for process in processes):
+        try:
+            barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            pass    # timed out, the barrier is broken for the workers too
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    arrays.clear()
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            pass    # still viewed, e.g. by positions, closed with the views
+        block.unlink()
+
+
+class ParallelFlock:
+    """
+    Flock stepped by worker processes, each owning a slab of the domain
+    along x; the state is double buffered in shared memory so that the
+    main process always reads a finished step; the workers are released by
+    close, or when the flock dies or at exit at the latest
+    """
+    timeout = 5     # seconds the workers are waited for when released
+
+    def __init__(self, flock, workers=None):
+        self.number = flock.number
+        self.deltat = flock.deltat
+        self.workers = workers or mp.cpu_count()
+        parameters = {'perception': flock.perception, 'deltat': flock.deltat, 'max_speed': flock.max_speed,
+                      'max_force': flock.max_force, 'bound': flock.bound, 'indexed': flock.grid is not None}
+        # obstacles avoided in this process, the environment being made of
+        # functions of the scene the workers do not have, see step
+        self.environment, self.frame = flock.environment, flock.frame
+        self.local = Flock(0, **parameters)
+
+        # state[buffer, field, boid, axis] and control = (buffer, slab bounds)
+        shape = (2, len(FIELDS), self.number, 3)
+        self.blocks = [shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 4)),
+                       shared_memory.SharedMemory(create=True, size=(self.workers + 2) * 8)]
+        self.arrays = [np.ndarray(shape, np.float32, buffer=self.blocks[0].buf),
+                       np.ndarray((self.workers + 2,), np.float64, buffer=self.blocks[1].buf)]
+        for field, name in enumerate(FIELDS):
+            self.state[0, field] = getattr(flock, name)
+        self.control[0] = 0
+
+        # spawned processes do not inherit the OpenGL context nor threads
+        context = mp.get_context('spawn')
+        self.barrier = context.Barrier(self.workers + 1)
+        self.stopped = context.Event()
+        names = [block.name for block in self.blocks]
+        self.processes = [context.Process(target=_worker, daemon=True,
+                                          args=(rank, names, self.number, self.workers, parameters,
+                                                self.barrier, self.stopped))
+                          for rank in range(self.workers)]
+        for process in self.processes:
+            process.start()
+        # no reference to self, so that the flock can die before exit
+        self.finalizer = weakref.finalize(self, _release, self.processes, self.blocks, self.arrays,
+                                          self.barrier, self.stopped, self.timeout)
+
+    @property
+    def state(self):
+        return self.arrays[0]
+
+    @property
+    def control(self):
+        return self.arrays[1]
+
+    @property
+    def positions(self):
+        return self.state[int(self.control[0]), 0]
+
+    @property
+    def velocities(self):
+        return self.state[int(self.control[0]), 1]
+
+    @property
+    def orientations(self):
+        return self.state[int(self.control[0]), 3]
+
+    def step(self):
+        """
+        One simulation step, the slabs holding the same number of boids; the
+        obstacles are avoided here, on the whole flock, before the workers
+        steer and move their boids
+        """
+        if self.environment is not None:
+            local = self.local
+            local.number, local.environment, local.frame = self.number, self.environment, self.frame
+            local.positions, local.velocities, local.accelerations, local.orientations = \
+                self.state[int(self.control[0])]
+            local.avoid()
+
+        x = self.positions[:, 0]
+        self.control[1] = -np.inf
+        self.control[2:-1] = np.quantile(x, np.arange(1, self.workers) / self.workers)
+        self.control[-1] = np.inf
+        self.barrier.wait()     # workers start
+        self.barrier.wait()     # workers are done
+        self.control[0] = 1 - self.control[0]
+
+    def model_matrices(self, scaling=1):
+        """ Translation @ scaling @ rotation 4x4 matrices of every boid """
+        return model_matrices(self.positions, self.orientations, scaling)
+
+    def close(self):
+        """ Stop the workers and free the shared memory, once """
+        self.finalizer()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Recording of boids runs and replay from memory-mapped files
+"""
+
+import struct
+import time
+
+import numpy as np
+
+from src.flock import *
+
+# magic, number of boids, number of ticks, tick period in seconds
+HEADER = struct.Struct('<8sIId')
+MAGIC = b'BOIDREC1'
+FIELDS = ('positions', 'velocities', 'orientations')
+
+
+class FlockRecorder:
+    """ Appends the state of a flock at every tick to a raw float32 file """
+    def __init__(self, path, number, period):
+        self.file = open(path, 'wb')
+        self.number, self.period, self.ticks = number, period, 0
+        self.file.write(HEADER.pack(MAGIC, number, 0, period))
+
+    def append(self, flock):
+        """ Record the current tick, the header always stays valid """
+        frame = np.stack([getattr(flock, field) for field in FIELDS])
+        self.file.write(np.ascontiguousarray(frame, np.float32).tobytes())
+        self.ticks += 1
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, self.number, self.ticks, self.period))
+        self.file.seek(0, 2)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __del__(self):  # object dies => close the file
+        self.close()
+
+
+def record(flock, path, ticks, tick_rate=60):
+    """ Simulate a flock offline for a given number of ticks, recording
+        its initial state and every tick """
+    recorder = FlockRecorder(path, flock.number, 1 / tick_rate)
+    recorder.append(flock)
+    for _ in range(ticks):
+        flock.step()
+        recorder.append(flock)
+    recorder.close()
+
+
+class FlockReplay:
+    """
+    Plays back a recorded run in place of a FlockScheduler: any tick can be
+    reached at no simulation cost, the frames being read from a memory map
+    """
+    def __init__(self, path, loop=True):
+        with open(path, 'rb') as file:
+            magic, self.number, self.ticks, self.period = HEADER.unpack(file.read(HEADER.size))
+        assert magic == MAGIC, 'Not a boids recording: %s' % path
+        assert self.ticks > 0, 'Empty boids recording: %s' % path
+        self.frames = np.memmap(path, np.float32, 'r', offset=HEADER.size,
+                                shape=(self.ticks, len(FIELDS), self.number, 3))
+        self.loop = loop
+        self.origin = time.perf_counter()
+
+    def start(self):
+        """ Nothing to start, the replay only depends on the wall clock """
+
+    def stop(self):
+        """ Nothing to stop, the replay only depends on the wall clock """
+
+    def seek(self, tick, now=None):
+        """ Restart the playback from a given tick """
+        now = time.perf_counter() if now is None else now
+        self.origin = now - tick * self.period
+
+    def tick(self, now=None):
+        """ Tick being played, with its fractional part """
+        now = time.perf_counter() if now is None else now
+        tick = (now - self.origin) / self.period
+        if self.loop and self.ticks > 1:
+            # from the first to the last tick, then straight back to the first
+            return tick % (self.ticks - 1)
+        return float(np.clip(tick, 0, self.ticks - 1))
+
+    def state(self, now=None):
+        """ Positions and orientations interpolated between two ticks """
+        tick = self.tick(now)
+        index = int(tick)
+        alpha = tick - index
+        previous, current = self.frames[index], self.frames[min(index + 1, self.ticks - 1)]
+        positions = previous[0] + alpha * (current[0] - previous[0])
+        orientations = previous[2] + alpha * (current[2] - previous[2])
+        norms = np.linalg.norm(orientations, axis=1, keepdims=True)
+        orientations = np.divide(orientations, norms, out=np.array(current[2]), where=norms > 0)
+        return positions, orientations
+
+    def model_matrices(self, scaling=1):
+        """ Model matrices of the interpolated state """
+        return model_matrices(*self.state(), scaling)
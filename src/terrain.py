@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""
+Terrain split in square chunks drawn at several levels of detail, selected
+through a quadtree of bounding boxes, or streamed tile by tile from a
+memory-mapped height map or from procedural noise; independent of any
+OpenGL state
+"""
+
+import collections
+import functools
+import struct
+import threading
+
+import numpy as np
+
+# magic, rows, columns, numpy dtype of the samples, scale and offset making
+# world heights of the samples
+HEIGHTMAP_HEADER = struct.Struct('<8sII4sdd')
+HEIGHTMAP_MAGIC = b'HEIGHTS1'
+
+# bits of the edges of a chunk stitched to a coarser neighbour, the rows of
+# the height map going along z
+NORTH, EAST, SOUTH, WEST = 1, 2, 4, 8
+
+
+@functools.lru_cache(maxsize=None)
+def lod_indices(cells, step, edges):
+    """
+    Triangles of a chunk of (cells+1)**2 vertices using one vertex every
+    step, the odd vertices of the edges given as bits of edges being moved
+    to the previous even one to match a neighbour twice coarser; the
+    triangles made degenerate are left out
+    """
+    side = cells + 1
+    starts = np.arange(0, cells, step)
+    row, col = (a.ravel() for a in np.meshgrid(starts, starts, indexing='ij'))
+
+    def vertex(row, col):
+        odd = 2 * step
+        if edges & NORTH:
+            col = np.where((row == 0) & (col % odd == step), col - step, col)
+        if edges & SOUTH:
+            col = np.where((row == cells) & (col % odd == step), col - step, col)
+        if edges & WEST:
+            row = np.where((col == 0) & (row % odd == step), row - step, row)
+        if edges & EAST:
+            row = np.where((col == cells) & (row % odd == step), row - step, row)
+        return row * side + col
+
+    top_left, top_right = vertex(row, col), vertex(row, col + step)
+    bottom_left, bottom_right = vertex(row + step, col), vertex(row + step, col + step)
+    triangles = np.concatenate([np.stack([top_left, bottom_left, top_right], axis=1),
+                                np.stack([top_right, bottom_left, bottom_right], axis=1)])
+    degenerate = (triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2]) | \
+                 (triangles[:, 0] == triangles[:, 2])
+    indices = triangles[~degenerate].ravel().astype(np.uint16 if side**2 <= 2**16 else np.uint32)
+    indices.flags.writeable = False
+    return indices
+
+
+def lod_index_sets(cells, levels):
+    """
+    Index sets of every level of detail and stitching of a chunk, in a
+    single array, and their (first, count) ranges by (level, edges)
+    """
+    sets, ranges, first = [], {}, 0
+    for level in range(levels):
+        for edges in range(16):
+            indices = lod_indices(cells, 2**level, edges)
+            ranges[level, edges] = (first, indices.size)
+            sets.append(indices)
+            first += indices.size
+    return np.concatenate(sets), ranges
+
+
+def distance_levels(lower, upper, camera, lod_distance, levels):
+    """ Level of detail of boxes, one more every time the distance to the
+        camera doubles past lod_distance """
+    gaps = np.maximum(np.maximum(lower - camera, camera - upper), 0)
+    distances = np.linalg.norm(gaps, axis=1)
+    return np.minimum(np.floor(np.log2(distances / lod_distance + 1)).astype(int), levels - 1)
+
+
+def relaxed_levels(levels, top):
+    """
+    2D grid of levels lowered until 4-neighbours differ by one level at
+    most, the cells at top or above standing for missing chunks
+    """
+    for _ in range(top):
+        padded = np.pad(levels, 1, constant_values=top)
+        neighbours = np.minimum(np.minimum(padded[:-2, 1:-1], padded[2:, 1:-1]),
+                                np.minimum(padded[1:-1, :-2], padded[1:-1, 2:]))
+        levels = np.where(levels < top, np.minimum(levels, neighbours + 1), levels)
+    return levels
+
+
+def stitched_edges(levels, top):
+    """ Bits of the edges of every chunk of a 2D grid of levels having a
+        coarser neighbour, the cells at top or above being missing chunks """
+    padded = np.pad(levels, 1, constant_values=top)
+    padded = np.where(padded < top, padded, -1)
+    return (padded[:-2, 1:-1] > levels) * NORTH + (padded[1:-1, 2:] > levels) * EAST + \
+           (padded[2:, 1:-1] > levels) * SOUTH + (padded[1:-1, :-2] > levels) * WEST
+
+
+def bilinear_surface(samples, x, z, spacing, origin=(0, 0)):
+    """
+    Heights and normals at the positions (x, z), given as arrays, of the
+    bilinear surface through a grid of samples spacing apart, the sample
+    (row, column) being at origin + spacing * (column, row); samples(rows,
+    columns) gives the heights of the samples of index arrays
+    """
+    u = (np.asarray(x, np.float64) - origin[0]) / spacing
+    v = (np.asarray(z, np.float64) - origin[1]) / spacing
+    columns, rows = np.floor(u).astype(np.int64), np.floor(v).astype(np.int64)
+    u, v = u - columns, v - rows
+    top_left, top_right = samples(rows, columns), samples(rows, columns + 1)
+    bottom_left, bottom_right = samples(rows + 1, columns), samples(rows + 1, columns + 1)
+    top, bottom = top_left + u * (top_right - top_left), bottom_left + u * (bottom_right - bottom_left)
+    heights = top + v * (bottom - top)
+
+    # normals of the surface, from the gradient of the heights
+    normals = np.empty(np.shape(heights) + (3,))
+    normals[..., 0] = -((1 - v) * (top_right - top_left) + v * (bottom_right - bottom_left)) / spacing
+    normals[..., 1] = 1
+    normals[..., 2] = -(bottom - top) / spacing
+    normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+    return heights.astype(np.float32), normals.astype(np.float32)
+
+
+def box_visibility(planes, lower, upper):
+    """
+    Classification of axis aligned boxes against planes (a, b, c, d) whose
+    positive side is inside: (any part inside, fully inside) boolean arrays
+    """
+    normals, offsets = planes[:, :3], planes[:, 3]
+    positive = normals[None, :, :] >= 0
+    farthest = np.where(positive, upper[:, None, :], lower[:, None, :])
+    nearest = np.where(positive, lower[:, None, :], upper[:, None, :])
+    outside = (np.einsum('bpk,pk->bp', farthest, normals) + offsets < 0).any(axis=1)
+    inside = (np.einsum('bpk,pk->bp', nearest, normals) + offsets >= 0).all(axis=1)
+    return ~outside, inside
+
+
+class TerrainChunks:
+    """
+    Square grid of n x n vertices cut in chunks of cells x cells squares,
+    each stored as its own block of (cells+1)**2 vertices; the chunks past
+    the grid border repeat its last vertices and collapse to nothing. Without
+    vertices, the bounding boxes come from set_heights
+    """
+    def __init__(self, vertices, number_vertices_x, cells=64, levels=4, lod_distance=300):
+        assert cells % 2**(levels - 1) == 0, 'cells has to be a multiple of the coarsest step'
+        self.cells, self.levels, self.lod_distance = cells, levels, lod_distance
+        self.number = -(-(number_vertices_x - 1) // cells)    # chunks along one axis
+        side = cells + 1
+
+        # global vertex of each vertex of each chunk, row by row of chunks
+        local = np.arange(side)
+        rows = np.minimum(np.arange(self.number)[:, None] * cells + local[None, :], number_vertices_x - 1)
+        self.gather = (rows[:, None, :, None] * number_vertices_x + rows[None, :, None, :]).reshape(-1, side**2)
+        self.base_vertices = (np.arange(self.number**2) * side**2).astype(np.int32)
+
+        self.indices, self.ranges = lod_index_sets(cells, levels)
+        self.drawn = self.culled = 0
+        self.lower, self.upper = np.zeros((self.number**2, 3)), np.zeros((self.number**2, 3))
+        if vertices is not None:
+            chunk_vertices = np.asarray(vertices)[self.gather]
+            self.set_bounds(chunk_vertices.min(axis=1), chunk_vertices.max(axis=1))
+
+    def set_heights(self, heights, size, translation=0, chunks=None):
+        """
+        Bounding boxes of the chunks (all by default) of a grid of heights
+        raised by translation, rows along z, spanning size x size centered
+        on (0, 0)
+        """
+        number_vertices_x = len(heights)
+        chunks = np.arange(self.number**2) if chunks is None else np.asarray(chunks)
+        gather = self.gather[chunks]
+        rows, columns = np.divmod(gather, number_vertices_x)
+        steps = size / (number_vertices_x - 1)
+        chunk_heights = np.asarray(heights).ravel()[gather]
+        lower = np.stack([columns.min(axis=1) * steps, chunk_heights.min(axis=1), rows.min(axis=1) * steps], axis=1)
+        upper = np.stack([columns.max(axis=1) * steps, chunk_heights.max(axis=1), rows.max(axis=1) * steps], axis=1)
+        center = np.array([size / 2, -translation, size / 2])
+        self.lower[chunks], self.upper[chunks] = lower - center, upper - center
+        self.set_bounds(self.lower, self.upper)
+
+    def set_bounds(self, lower, upper):
+        """ Quadtree of bounding boxes, from the chunks up to a single root """
+        depth = int(np.ceil(np.log2(self.number))) if self.number > 1 else 0
+        size = 2**depth
+        lower_level = np.full((size, size, 3), np.inf)
+        upper_level = np.full((size, size, 3), -np.inf)
+        lower_level[:self.number, :self.number] = lower.reshape(self.number, self.number, 3)
+        upper_level[:self.number, :self.number] = upper.reshape(self.number, self.number, 3)
+        self.tree = [(lower_level, upper_level)]
+        while len(self.tree[0][0]) > 1:
+            lower_level, upper_level = self.tree[0]
+            half = len(lower_level) // 2
+            self.tree.insert(0, (lower_level.reshape(half, 2, half, 2, 3).min(axis=(1, 3)),
+                                 upper_level.reshape(half, 2, half, 2, 3).max(axis=(1, 3))))
+        self.lower, self.upper = lower, upper
+
+    def chunk_attributes(self, attribute):
+        """ Per vertex attribute of the grid, laid out chunk by chunk """
+        return np.asarray(attribute)[self.gather].reshape(-1, np.shape(attribute)[-1])
+
+    def visible(self, planes):
+        """ Chunks of which some part is in front of all the planes """
+        nodes, chunks = np.zeros((1, 2), int), []
+        for depth, (lower, upper) in enumerate(self.tree):
+            lower, upper = lower[nodes[:, 0], nodes[:, 1]], upper[nodes[:, 0], nodes[:, 1]]
+            empty = (lower > upper).any(axis=1)
+            with np.errstate(invalid='ignore'):
+                partly, fully = box_visibility(planes, np.where(empty[:, None], 0, lower),
+                                               np.where(empty[:, None], 0, upper))
+            partly &= ~empty
+            # the whole subtree of a node fully inside is visible
+            span = 2**(len(self.tree) - 1 - depth)
+            inside = nodes[partly & fully] * span
+            offsets = np.stack(np.meshgrid(np.arange(span), np.arange(span), indexing='ij'), axis=-1).reshape(-1, 2)
+            chunks.append((inside[:, None, :] + offsets[None, :, :]).reshape(-1, 2))
+            nodes = nodes[partly & ~fully]
+            if depth < len(self.tree) - 1:
+                nodes = (nodes[:, None, :] * 2 + np.array([[0, 0], [0, 1], [1, 0], [1, 1]])[None]).reshape(-1, 2)
+        chunks.append(nodes)
+        chunks = np.concatenate(chunks)
+        chunks = chunks[(chunks < self.number).all(axis=1)]
+        return chunks[:, 0] * self.number + chunks[:, 1]
+
+    def lod_levels(self, camera):
+        """
+        Level of detail of every chunk, growing with the distance to the
+        camera (x, y, z), neighbours differing by one level at most
+        """
+        levels = distance_levels(self.lower, self.upper, camera, self.lod_distance, self.levels)
+        return relaxed_levels(levels.reshape(self.number, self.number), self.levels)
+
+    def select(self, planes, camera):
+        """
+        Index ranges (firsts, counts) and base vertices of the chunks to draw
+        for the frustum planes and the camera position
+        """
+        levels = self.lod_levels(camera)
+        edges = stitched_edges(levels, self.levels)
+        chunks = self.visible(planes)
+        self.drawn, self.culled = len(chunks), self.number**2 - len(chunks)
+        ranges = np.array([self.ranges[key] for key in zip(levels.ravel()[chunks], edges.ravel()[chunks])],
+                          int).reshape(-1, 2)
+        return ranges[:, 0], ranges[:, 1], self.base_vertices[chunks]
+
+    def chunks_of(self, row, column, rows, columns):
+        """ Chunks holding some vertex of a block of the grid """
+        first = np.maximum((np.array([row, column]) - 1) // self.cells, 0)
+        last = np.minimum((np.array([row + rows, column + columns]) - 1) // self.cells, self.number - 1)
+        chunk_rows, chunk_columns = np.arange(first[0], last[0] + 1), np.arange(first[1], last[1] + 1)
+        return (chunk_rows[:, None] * self.number + chunk_columns[None, :]).ravel()
+
+
+def save_heightmap(path, samples, scale=1, offset=0):
+    """ Write a 2D array of samples as a raw height map file, the world
+        heights being samples * scale + offset """
+    samples = np.asarray(samples)
+    dtype = samples.dtype.newbyteorder('<').str.encode()
+    with open(path, 'wb') as file:
+        file.write(HEIGHTMAP_HEADER.pack(HEIGHTMAP_MAGIC, *samples.shape, dtype, scale, offset))
+        samples.astype(dtype.decode(), copy=False).tofile(file)
+
+
+class Heightmap:
+    """
+    Raw height map file read through a memory map: only the pages of the
+    samples being read are loaded, whatever the size of the file
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            magic, self.rows, self.columns, dtype, self.scale, self.offset = \
+                HEIGHTMAP_HEADER.unpack(file.read(HEIGHTMAP_HEADER.size))
+        assert magic == HEIGHTMAP_MAGIC, 'Not a raw height map: %s' % path
+        self.samples = np.memmap(path, np.dtype(dtype.rstrip(b'\0').decode()), 'r',
+                                 offset=HEIGHTMAP_HEADER.size, shape=(self.rows, self.columns))
+
+    def block(self, row, column, rows, columns):
+        """ World heights of a block of samples, the ones past the borders
+            repeating the border ones """
+        rows = np.clip(np.arange(row, row + rows), 0, self.rows - 1)
+        columns = np.clip(np.arange(column, column + columns), 0, self.columns - 1)
+        samples = self.samples[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
+        samples = samples[rows - rows[0]][:, columns - columns[0]]
+        return samples.astype(np.float32) * np.float32(self.scale) + np.float32(self.offset)
+
+    def at(self, rows, columns):
+        """ World heights of the samples of index arrays rows and columns """
+        return self.samples[rows, columns] * self.scale + self.offset
+
+
+# unit gradients of the lattice points of the noise
+GRADIENTS = np.stack([np.cos(np.arange(8) * np.pi / 4), np.sin(np.arange(8) * np.pi / 4)])
+
+
+def lattice_hash(x, z, seed):
+    """ Pseudo random uint32 of the integer lattice points (x, z), seed
+        being an integer or an array broadcasting with them """
+    x = (np.asarray(x, np.int64) & 0xffffffff).astype(np.uint32)
+    z = (np.asarray(z, np.int64) & 0xffffffff).astype(np.uint32)
+    seed = (np.asarray(seed, np.int64) * 0xcb1ab31f & 0xffffffff).astype(np.uint32)
+    hashed = x * np.uint32(0x8da6b343) ^ z * np.uint32(0xd8163841) ^ seed
+    hashed ^= hashed >> np.uint32(13)
+    hashed *= np.uint32(0x5bd1e995)
+    return hashed ^ hashed >> np.uint32(15)
+
+
+def gradient_noise(x, z, seed=0):
+    """
+    2D gradient noise of the coordinate arrays x and z, in [-1, 1], null on
+    the integer lattice and smooth in between
+    """
+    x0, z0 = np.floor(x), np.floor(z)
+    fx, fz = x - x0, z - z0
+
+    def corner(dx, dz):
+        gradients = lattice_hash(x0 + dx, z0 + dz, seed) >> np.uint32(29)
+        return GRADIENTS[0].take(gradients) * (fx - dx) + GRADIENTS[1].take(gradients) * (fz - dz)
+
+    u, v = (f * f * f * (f * (f * 6 - 15) + 10) for f in (fx, fz))
+    top_left, top_right, bottom_left, bottom_right = corner(0, 0), corner(1, 0), corner(0, 1), corner(1, 1)
+    top = top_left + u * (top_right - top_left)
+    bottom = bottom_left + u * (bottom_right - bottom_left)
+    return np.sqrt(2) * (top + v * (bottom - top))
+
+
+class ProceduralHeights:
+    """
+    Unbounded height source of fractal noise: octaves layers of gradient
+    noise, each one of lacunarity times the frequency (in cycles per
+    sample) and persistence times the amplitude of the previous one
+    """
+    rows = columns = None
+
+    def __init__(self, amplitude=100, frequency=1 / 256, octaves=6, persistence=0.5, lacunarity=2, offset=0, seed=0):
+        self.amplitude, self.frequency, self.octaves = amplitude, frequency, octaves
+        self.persistence, self.lacunarity = persistence, lacunarity
+        self.offset, self.seed = offset, seed
+
+    def at(self, rows, columns):
+        """ World heights of the samples of index arrays rows and columns """
+        rows, columns = np.broadcast_arrays(np.asarray(rows, np.float64), np.asarray(columns, np.float64))
+        # all the octaves at once, along a first axis
+        octaves = np.arange(self.octaves).reshape(-1, *(1,) * rows.ndim)
+        frequencies = self.frequency * self.lacunarity**octaves
+        noise = gradient_noise(columns * frequencies, rows * frequencies, self.seed + octaves)
+        heights = (self.amplitude * self.persistence**octaves * noise).sum(axis=0)
+        return (heights + self.offset).astype(np.float32)
+
+    def block(self, row, column, rows, columns):
+        """ World heights of a block of samples """
+        return self.at(np.arange(row, row + rows)[:, None], np.arange(column, column + columns)[None, :])
+
+
+class TileStreamer:
+    """
+    Tiles of cells x cells squares of a height source (Heightmap or
+    ProceduralHeights) within radius tiles of the camera: workers background
+    threads make them into a cache of the cache_tiles last used tiles, and
+    each frame at most upload_budget of them are given one of the gpu_tiles
+    slots of (cells+1)**2 vertices, the least recently used slot being taken
+    back when none is free. Samples are spacing apart, a Heightmap being
+    centered on (0, 0), and tiles are drawn at levels of detail like the
+    chunks of TerrainChunks
+    """
+    def __init__(self, source, spacing=1, translation=0, cells=64, levels=4, lod_distance=None,
+                 radius=3, cache_tiles=None, gpu_tiles=None, upload_budget=4, workers=1):
+        assert cells % 2**(levels - 1) == 0, 'cells has to be a multiple of the coarsest step'
+        self.source, self.spacing, self.translation = source, spacing, translation
+        self.cells, self.levels, self.side = cells, levels, cells + 1
+        self.lod_distance = lod_distance or cells * spacing
+        self.bounded = source.rows is not None
+        self.tiles, self.origin = None, np.zeros(2)
+        if self.bounded:
+            self.tiles = (-(-(source.rows - 1) // cells), -(-(source.columns - 1) // cells))
+            self.origin = -np.array([(source.columns - 1) * spacing / 2, (source.rows - 1) * spacing / 2])
+        self.radius, self.upload_budget, self.workers = radius, upload_budget, workers
+        self.gpu_tiles = gpu_tiles or (2 * radius + 1)**2 + 4 * (2 * radius + 1)
+        self.cache_tiles = cache_tiles or 2 * self.gpu_tiles
+        self.indices, self.ranges = lod_index_sets(cells, levels)
+
+        # cache filled by the loader threads, least recently used tile first
+        self.cache, self.pending = collections.OrderedDict(), set()
+        self.wanted, self.window = [], (0, 0)   # keys around the camera, nearest first
+        self.lock = threading.Condition()
+        self.stopped = threading.Event()
+        self.threads = []
+
+        # slots of the vertex buffer, least recently used first
+        self.slots = collections.OrderedDict()
+        self.free = list(range(self.gpu_tiles))[::-1]
+        self.bounds = {}
+        self.loaded = self.uploaded = self.evicted = self.drawn = self.culled = 0
+
+    def start(self):
+        """ Start the loader threads, if not already running """
+        if not self.threads:
+            self.stopped.clear()
+            self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+
+    def stop(self):
+        """ Stop the loader threads after their current tile """
+        if self.threads:
+            self.stopped.set()
+            with self.lock:
+                self.lock.notify_all()
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+
+    def run(self):
+        """ Loader loop: make the nearest wanted tile neither cached nor
+            pending, or sleep until the wanted tiles change """
+        while True:
+            with self.lock:
+                key = None
+                while not self.stopped.is_set():
+                    key = next((key for key in self.wanted if key not in self.cache and key not in self.pending), None)
+                    if key is not None:
+                        break
+                    self.lock.wait()
+                if key is None:
+                    break
+                self.pending.add(key)
+            tile = self.load(key)
+            with self.lock:
+                self.pending.discard(key)
+                self.cache[key] = tile
+                while len(self.cache) > self.cache_tiles:
+                    self.cache.popitem(last=False)
+                self.loaded += 1
+
+    def load(self, key):
+        """ Vertices, normals and bounding box of a tile """
+        row, column = key[0] * self.cells, key[1] * self.cells
+        heights = self.source.block(row - 1, column - 1, self.side + 2, self.side + 2) + self.translation
+        rows, columns = row + np.arange(self.side), column + np.arange(self.side)
+        if self.bounded:
+            rows, columns = np.minimum(rows, self.source.rows - 1), np.minimum(columns, self.source.columns - 1)
+
+        vertices = np.empty((self.side, self.side, 3), np.float32)
+        vertices[..., 0] = self.origin[0] + columns[None, :] * self.spacing
+        vertices[..., 1] = heights[1:-1, 1:-1]
+        vertices[..., 2] = self.origin[1] + rows[:, None] * self.spacing
+        normals = np.empty((self.side, self.side, 3), np.float32)
+        normals[..., 0] = heights[1:-1, :-2] - heights[1:-1, 2:]
+        normals[..., 1] = 2 * self.spacing
+        normals[..., 2] = heights[:-2, 1:-1] - heights[2:, 1:-1]
+        normals /= np.linalg.norm(normals, axis=2, keepdims=True)
+
+        vertices, normals = vertices.reshape(-1, 3), normals.reshape(-1, 3)
+        return vertices, normals, vertices.min(axis=0), vertices.max(axis=0)
+
+    def request(self, camera):
+        """ Make the tiles within radius of the camera (x, y, z) the wanted
+            ones, nearest first """
+        center = np.floor((np.asarray(camera)[[2, 0]] - self.origin[::-1]) / (self.cells * self.spacing)).astype(int)
+        steps = np.arange(-self.radius, self.radius + 1)
+        keys = np.stack(np.meshgrid(center[0] + steps, center[1] + steps, indexing='ij'), axis=-1).reshape(-1, 2)
+        if self.bounded:
+            keys = keys[((keys >= 0) & (keys < self.tiles)).all(axis=1)]
+        centers = (keys[:, ::-1] + 0.5) * self.cells * self.spacing + self.origin
+        order = np.argsort(np.linalg.norm(centers - np.asarray(camera)[[0, 2]], axis=1), kind='stable')
+        wanted = [tuple(key) for key in keys[order].tolist()]
+        with self.lock:
+            if wanted != self.wanted:
+                self.wanted, self.window = wanted, tuple(center - self.radius)
+                self.lock.notify_all()
+            for key in wanted:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+
+    def uploads(self, camera):
+        """
+        Tiles to upload for the camera (x, y, z), as (slot, vertices,
+        normals), at most upload_budget of them, the nearest first
+        """
+        self.request(camera)
+        for key in self.wanted:
+            if key in self.slots:
+                self.slots.move_to_end(key)
+        uploads = []
+        with self.lock:
+            for key in self.wanted:
+                if len(uploads) == self.upload_budget:
+                    break
+                if key in self.slots or key not in self.cache:
+                    continue
+                if not self.free:
+                    oldest = next(iter(self.slots))
+                    if oldest in self.wanted:
+                        break   # every slot is in view
+                    self.free.append(self.slots.pop(oldest))
+                    del self.bounds[oldest]
+                    self.evicted += 1
+                self.cache.move_to_end(key)
+                vertices, normals, lower, upper = self.cache[key]
+                self.slots[key] = self.free.pop()
+                self.bounds[key] = lower, upper
+                uploads.append((self.slots[key], vertices, normals))
+        self.uploaded += len(uploads)
+        return uploads
+
+    def select(self, planes, camera):
+        """
+        Index ranges (firsts, counts) and base vertices of the resident
+        tiles to draw for the frustum planes and the camera position
+        """
+        keys = [key for key in self.wanted if key in self.slots]
+        if not keys:
+            self.drawn = self.culled = 0
+            return np.zeros(0, int), np.zeros(0, int), np.zeros(0, np.int32)
+        lower, upper = (np.array(bound) for bound in zip(*(self.bounds[key] for key in keys)))
+        visible, _ = box_visibility(planes, lower, upper)
+
+        # levels on the grid of the window around the camera, missing tiles left out
+        cells = np.array(keys) - self.window
+        levels = np.full((2 * self.radius + 1,) * 2, self.levels)
+        levels[cells[:, 0], cells[:, 1]] = distance_levels(lower, upper, camera, self.lod_distance, self.levels)
+        levels = relaxed_levels(levels, self.levels)
+        edges = stitched_edges(levels, self.levels)
+
+        cells = cells[visible]
+        self.drawn, self.culled = len(cells), len(keys) - len(cells)
+        ranges = np.array([self.ranges[key] for key in zip(levels[cells[:, 0], cells[:, 1]],
+                                                           edges[cells[:, 0], cells[:, 1]])], int).reshape(-1, 2)
+        slots = np.array([self.slots[key] for key, shown in zip(keys, visible) if shown], np.int32)
+        return ranges[:, 0], ranges[:, 1], slots * self.side**2
+
+    def sample_heights(self, rows, columns):
+        """ Heights of the samples of index arrays, 0 past the borders """
+        inside = np.ones(np.shape(rows), bool)
+        if self.bounded:
+            inside = (rows >= 0) & (rows < self.source.rows) & (columns >= 0) & (columns < self.source.columns)
+        heights = np.zeros(np.shape(rows), np.float32)
+        heights[inside] = self.source.at(rows[inside], columns[inside])
+        return heights + self.translation
+
+    def surface(self, x, z):
+        """ Heights and normals of the terrain at the positions (x, z), given
+            as arrays, bilinearly interpolated between the samples """
+        return bilinear_surface(self.sample_heights, x, z, self.spacing, self.origin)
@@ -71,6 +71,43 @@ def frustum(xmin, xmax, ymin, ymax, zmin, zmax):
                      [0,  0, -1, 0]], 'f')
 
 
+def frustum_planes(matrix):
+    """ 6 normalized planes (a, b, c, d) of the frustum of a projection (or
+        projection @ view @ model) matrix, inside points having a*x + b*y +
+        c*z + d >= 0 in the space the matrix transforms from """
+    matrix = np.asarray(matrix, np.float64)
+    planes = np.array([matrix[3] + matrix[0], matrix[3] - matrix[0],   # left, right
+                       matrix[3] + matrix[1], matrix[3] - matrix[1],   # bottom, top
+                       matrix[3] + matrix[2], matrix[3] - matrix[2]])  # near, far
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+# Axis aligned boxes, as (lower, upper) corners ------------------------------
+def bounding_box(points):
+    """ smallest axis aligned box holding the 3d points """
+    points = np.asarray(points, np.float32)
+    return points.min(axis=0), points.max(axis=0)
+
+
+def transformed_box(matrix, lower, upper):
+    """ axis aligned box holding the box transformed by an affine matrix, or
+        by each of a stack of matrices for a stack of boxes """
+    matrix = np.asarray(matrix, np.float32)
+    center, half = (lower + upper) / 2, (upper - lower) / 2
+    center = matrix[..., :3, :3] @ center + matrix[..., :3, 3]
+    half = np.abs(matrix[..., :3, :3]) @ half
+    return center - half, center + half
+
+
+def union_box(boxes):
+    """ box holding all the boxes, None if there are none or one is None,
+        i.e. of unknown extent """
+    boxes = list(boxes)
+    if not boxes or any(box is None for box in boxes):
+        return None
+    return np.min([box[0] for box in boxes], axis=0), np.max([box[1] for box in boxes], axis=0)
+
+
 def translate(x=0.0, y=0.0, z=0.0):
     """ matrix to translate from coordinates (x,y,z) or a vector x"""
     matrix = np.identity(4, 'f')
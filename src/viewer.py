@@ -3,9 +3,11 @@
 Python OpenGL practical application.
 """
 # Python built-in modules
+import ctypes                       # byte offsets in interleaved buffers
 import os                           # os function, i.e. checking file status
 from itertools import cycle
 import sys
+import time                         # scene time of the frames
 from PIL import Image               # load images for textures
 from bisect import bisect_left      # search sorted keyframe lists
 
@@ -14,12 +16,91 @@ import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 import assimpcy                     # 3D resource loader
-import copy
 import random
 
 from src.transform import *
+from src.terrain import box_visibility
 
 # ------------ low level OpenGL object wrappers ----------------------------
+class GLState:
+    """
+    Cache of the OpenGL state set through it: program in use, active texture
+    unit, texture bound to each unit and target, vertex array, and uniform
+    values of each program. Calls setting the value already set are skipped,
+    issued and avoided counting the calls made and skipped; the objects
+    deleted are forgotten, as OpenGL reuses their names
+    """
+    issued = avoided = 0
+    program = unit = vertex_array = None
+    textures = {}   # (unit, target): texture
+    uniforms = {}   # (program, location): values
+
+    @classmethod
+    def _set(cls, changed):
+        """ Count a call, returning whether it has to be made """
+        if changed:
+            cls.issued += 1
+        else:
+            cls.avoided += 1
+        return changed
+
+    @classmethod
+    def use_program(cls, program):
+        if cls._set(program != cls.program):
+            cls.program = program
+            GL.glUseProgram(program)
+
+    @classmethod
+    def active_texture(cls, unit):
+        """ Make texture unit (an index, not GL_TEXTUREi) the active one """
+        if cls._set(unit != cls.unit):
+            cls.unit = unit
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+
+    @classmethod
+    def bind_texture(cls, texture, unit=None, target=GL.GL_TEXTURE_2D):
+        """ Bind texture on unit, the active one by default """
+        if unit is not None:
+            cls.active_texture(unit)
+        if cls._set(cls.textures.get((cls.unit, target)) != texture or cls.unit is None):
+            cls.textures[cls.unit, target] = texture
+            GL.glBindTexture(target, texture)
+
+    @classmethod
+    def bind_vertex_array(cls, vertex_array):
+        if cls._set(vertex_array != cls.vertex_array):
+            cls.vertex_array = vertex_array
+            GL.glBindVertexArray(vertex_array)
+
+    @classmethod
+    def uniform(cls, setter, location, *values):
+        """ setter(location, *values), e.g. GL.glUniform3fv, for the
+            program in use unless its uniform already has these values """
+        key = tuple(value if np.isscalar(value) else np.asarray(value).tobytes() for value in values)
+        if cls._set(location != -1 and cls.uniforms.get((cls.program, location)) != key):
+            cls.uniforms[cls.program, location] = key
+            setter(location, *values)
+
+    @classmethod
+    def forget(cls, program=None, textures=(), vertex_array=None):
+        """ Drop the deleted objects from the cache """
+        if program is not None:
+            cls.uniforms = {key: values for key, values in cls.uniforms.items() if key[0] != program}
+        cls.textures = {key: texture for key, texture in cls.textures.items() if texture not in textures}
+        if vertex_array is not None and vertex_array == cls.vertex_array:
+            cls.vertex_array = None
+
+    @classmethod
+    def counts(cls):
+        """ (issued, avoided) calls so far """
+        return cls.issued, cls.avoided
+
+    @classmethod
+    def report(cls, since=(0, 0)):
+        """ Counts since the given counts(), as a printable line """
+        return '%d GL calls issued, %d avoided' % (cls.issued - since[0], cls.avoided - since[1])
+
+
 class Shader:
     """ Helper class to create and automatically destroy shader program """
     @staticmethod
@@ -56,11 +137,123 @@ class Shader:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 GL.glDeleteProgram(self.glid)
                 self.glid = None
+            else:
+                self._bind_blocks()
+
+    def _bind_blocks(self):
+        """ Uniform blocks of the same name read the same UniformBuffer """
+        for index in range(GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORM_BLOCKS)):
+            length = GL.GLint()
+            GL.glGetActiveUniformBlockiv(self.glid, index, GL.GL_UNIFORM_BLOCK_NAME_LENGTH, length)
+            name = ctypes.create_string_buffer(length.value)
+            GL.glGetActiveUniformBlockName(self.glid, index, length.value, None, name)
+            GL.glUniformBlockBinding(self.glid, index, UniformBuffer.binding(name.value.decode('ascii')))
 
     def __del__(self):
-        GL.glUseProgram(0)
+        GLState.use_program(0)
         if self.glid:                      # if this is a valid shader object
             GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
+            GLState.forget(program=self.glid)
+
+
+class UniformBuffer:
+    """ helper class to create and self destroy OpenGL uniform buffers; each
+        block name has its own binding point, shared by all the programs """
+    bindings = {}
+
+    @classmethod
+    def binding(cls, name):
+        """ Binding point of the uniform block name """
+        return cls.bindings.setdefault(name, len(cls.bindings))
+
+    def __init__(self, name, data, usage=GL.GL_DYNAMIC_DRAW):
+        self.name, self.usage = name, usage
+        self.glid = GL.glGenBuffers(1)
+        self.update(data)
+
+    def update(self, data):
+        """ Upload new content, data being laid out as the std140 block """
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferData(GL.GL_UNIFORM_BUFFER, np.frombuffer(bytes(data), np.uint8), self.usage)
+        self.bind()
+
+    def bind(self):
+        """ Make the programs using the block read this buffer """
+        GL.glBindBufferBase(GL.GL_UNIFORM_BUFFER, self.binding(self.name), self.glid)
+
+    def __del__(self):  # object dies => kill GL buffer from GPU
+        GL.glDeleteBuffers(1, [self.glid])
+
+
+# std140 layout of the Frame uniform block: 4 column major matrices, then
+# vec3 + float pairs
+FRAME_STD140 = np.dtype([('view', np.float32, (4, 4)), ('projection', np.float32, (4, 4)),
+                         ('view_inverse', np.float32, (4, 4)), ('projection_inverse', np.float32, (4, 4)),
+                         ('w_camera_position', np.float32, 3), ('time', np.float32),
+                         ('light_dir', np.float32, 3), ('padding', np.float32)])
+
+
+class FrameContext:
+    """
+    Camera, light and time of the frame being drawn, computed once per frame
+    by Viewer.run and read by all the shaders from the Frame uniform block;
+    current is the context of the last updated frame, for the drawables
+    needing these values on the CPU
+    """
+    current = None
+
+    def __init__(self, light_dir=(0, 1, 0), begin=None):
+        self.light_dir = vec(light_dir)
+        self.begin = time.time() if begin is None else begin
+        self.block = np.zeros(1, FRAME_STD140)
+        self.buffer = UniformBuffer('Frame', self.block)
+        self.update(identity(), identity())
+
+    def update(self, projection, view, now=None):
+        """ New frame seen through projection and view at the time now,
+            scene time being counted from begin """
+        self.projection, self.view = projection, view
+        self.projection_inverse, self.view_inverse = np.linalg.inv(projection), np.linalg.inv(view)
+        self.camera_position = self.view_inverse[:3, 3] / self.view_inverse[3, 3]
+        self.time = (time.time() if now is None else now) - self.begin
+
+        block = self.block[0]
+        for name in ('view', 'projection', 'view_inverse', 'projection_inverse'):
+            block[name] = getattr(self, name).T
+        block['w_camera_position'], block['time'] = self.camera_position, self.time
+        block['light_dir'] = self.light_dir
+        self.buffer.update(self.block)
+        FrameContext.current = self
+
+    def model_camera(self, model):
+        """ Camera position in the coordinates the model matrix transforms
+            from, only inverted if it is not the identity """
+        if np.array_equal(model, identity()):
+            return self.camera_position
+        camera = np.linalg.solve(model, np.append(self.camera_position, 1))
+        return camera[:3] / camera[3]
+
+
+class IndexBuffer:
+    """ helper class to create and self destroy OpenGL index buffers, stored
+        with the smallest unsigned type holding all the indices (8 bit
+        indices are left out, most drivers convert them on the fly) """
+    TYPES = ((2**16, np.uint16, GL.GL_UNSIGNED_SHORT),
+             (2**32, np.uint32, GL.GL_UNSIGNED_INT))
+
+    def __init__(self, index, usage=GL.GL_STATIC_DRAW):
+        index = np.asarray(index).ravel()
+        count = int(index.max()) + 1 if index.size else 0
+        _, dtype, self.type = next(t for t in self.TYPES if count <= t[0])
+        self.size, self.itemsize = index.size, np.dtype(dtype).itemsize
+
+        # uploaded through a target which is not part of any vertex array state
+        self.glid = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, self.glid)
+        GL.glBufferData(GL.GL_COPY_WRITE_BUFFER, index.astype(dtype, copy=False), usage)
+
+    def __del__(self):  # object dies => kill GL buffer from GPU
+        GL.glDeleteBuffers(1, [self.glid])
 
 
 class VertexArray:
@@ -71,8 +264,9 @@ class VertexArray:
 
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.glid)
+        GLState.bind_vertex_array(self.glid)
         self.buffers = []  # we will store buffers in a list
+        self.attribute_buffers = {}  # and index them by shader layout
         nb_primitives, size = 0, 0
 
         # load buffer per vertex attribute (in list with index = shader layout)
@@ -80,6 +274,7 @@ class VertexArray:
             if data is not None:
                 # bind a new vbo, upload its data to GPU, declare size and type
                 self.buffers.append(GL.glGenBuffers(1))
+                self.attribute_buffers[loc] = self.buffers[-1]
                 data = np.array(data, np.float32, copy=False)  # ensure format
                 nb_primitives, size = data.shape
                 GL.glEnableVertexAttribArray(loc)
@@ -87,34 +282,249 @@ class VertexArray:
                 GL.glBufferData(GL.GL_ARRAY_BUFFER, data, usage)
                 GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 0, None)
 
-        # optionally create and upload an index buffer for this object
+        # optionally create and upload an index buffer for this object, or
+        # use an IndexBuffer shared with other vertex arrays
         self.draw_command = GL.glDrawArrays
         self.arguments = (0, nb_primitives)
+        self.index_buffer = None
         if index is not None:
-            self.buffers += [GL.glGenBuffers(1)]
-            index_buffer = np.array(index, np.int32, copy=False)  # good format
-            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])
-            GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index_buffer, usage)
+            if not isinstance(index, IndexBuffer):
+                index = IndexBuffer(index, usage)
+            self.index_buffer = index
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, index.glid)
             self.draw_command = GL.glDrawElements
-            self.arguments = (index_buffer.size, GL.GL_UNSIGNED_INT, None)
+            self.arguments = (index.size, index.type, None)
 
     def execute(self, primitive):
         """ draw a vertex array, either as direct array or indexed array """
-        GL.glBindVertexArray(self.glid)
+        GLState.bind_vertex_array(self.glid)
+        self.draw(primitive)
+
+    def draw(self, primitive):
+        """ draw the vertex array, already bound, e.g. by a RenderQueue """
         self.draw_command(primitive, *self.arguments)
 
+    def execute_range(self, primitive, first, count):
+        """ draw count indices of the index buffer, starting from first """
+        GLState.bind_vertex_array(self.glid)
+        offset = ctypes.c_void_p(int(first) * self.index_buffer.itemsize)
+        GL.glDrawElements(primitive, int(count), self.index_buffer.type, offset)
+
+    def update(self, location, data, first=0):
+        """ overwrite the rows of the attribute at the given shader layout
+            location, starting from vertex first """
+        data = np.ascontiguousarray(data, np.float32)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.attribute_buffers[location])
+        GL.glBufferSubData(GL.GL_ARRAY_BUFFER, first * data[0].nbytes, data.nbytes, data)
+
+    def set_multi_draw(self, firsts, counts, base_vertices):
+        """ make execute draw several ranges of the index buffer in a single
+            call, the indices of each range being offset by its base vertex """
+        offsets = np.asarray(firsts, np.uintp) * self.index_buffer.itemsize
+        self.draw_ranges = (np.asarray(counts, np.int32), offsets,
+                            np.asarray(base_vertices, np.int32))
+        self.draw_command = GL.glMultiDrawElementsBaseVertex
+        self.arguments = (self.draw_ranges[0], self.index_buffer.type,
+                          offsets.ctypes.data_as(ctypes.POINTER(ctypes.c_void_p)),
+                          len(offsets), self.draw_ranges[2])
+
+    def add_instance_attributes(self, location, sizes, usage=GL.GL_STREAM_DRAW):
+        """ Create an interleaved buffer of per instance attributes of the
+            given sizes, the first one being bound at the given location """
+        GLState.bind_vertex_array(self.glid)
+        self.buffers.append(GL.glGenBuffers(1))
+        self.instance_buffer, self.instance_usage = self.buffers[-1], usage
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+        stride, offset = 4 * sum(sizes), 0
+        for loc, size in enumerate(sizes, location):
+            GL.glEnableVertexAttribArray(loc)
+            GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, stride, ctypes.c_void_p(offset))
+            GL.glVertexAttribDivisor(loc, 1)
+            offset += 4 * size
+        self.instanced_command = {GL.glDrawArrays: GL.glDrawArraysInstanced,
+                                  GL.glDrawElements: GL.glDrawElementsInstanced}[self.draw_command]
+
+    def execute_instanced(self, primitive, instances):
+        """ upload the per instance attributes, one row per instance, and
+            draw all the instances with a single call """
+        instances = np.ascontiguousarray(instances, np.float32)
+        GLState.bind_vertex_array(self.glid)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, instances, self.instance_usage)
+        self.instanced_command(primitive, *self.arguments, len(instances))
+
     def __del__(self):  # object dies => kill GL array and buffers from GPU
         GL.glDeleteVertexArrays(1, [self.glid])
         GL.glDeleteBuffers(len(self.buffers), self.buffers)
+        GLState.forget(vertex_array=self.glid)
+
+
+class RenderQueue:
+    """
+    Draw items collected while the scene graph is drawn, instead of being
+    drawn at once: drawables with a queued attribute, a state method giving
+    their (program, texture, vertex array) and a draw_item method are added
+    by their draw method while a queue is used as a context, and drawn when
+    leaving it sorted by state, only the state differing from the one of the
+    previous item being set. Texture 0 stands for no texture, on unit 0.
+    Blended (translucent) drawables are added apart and drawn after the
+    sorted items, from the farthest to the closest to the camera, each one
+    with its whole state
+    """
+    current = None
+
+    def __init__(self):
+        self.items = []
+        self.blended = []
+        # counts of the last submitted frame
+        self.draws = 0
+        self.changes = {'program': 0, 'texture': 0, 'vertex_array': 0}
+
+    def __enter__(self):
+        RenderQueue.current = self
+        return self
+
+    def __exit__(self, *exception):
+        RenderQueue.current = None
+        self.submit()
+
+    def add(self, drawable, *arguments):
+        """ Queue a draw_item(*arguments) call of drawable """
+        self.items.append((drawable.state(), len(self.items), drawable, arguments))
+
+    def add_blended(self, drawable, modelview, *arguments):
+        """ Queue a draw_item(*arguments) call of a blended drawable, its
+            depth being the one of the origin of the modelview matrix """
+        self.blended.append((modelview[2, 3], len(self.blended), drawable, arguments))
+
+    def submit(self):
+        """ Draw and empty the queue, counting the draws and state changes """
+        self.items.sort(key=lambda item: item[:2])   # stable: in graph order for a same state
+        self.draws, self.changes = len(self.items), dict.fromkeys(self.changes, 0)
+        program = texture = vertex_array = None
+        for (shader, diffuse, array), _, drawable, arguments in self.items:
+            if shader != program:
+                program = shader
+                GLState.use_program(program)
+                self.changes['program'] += 1
+            if diffuse and diffuse != texture:
+                texture = diffuse
+                GLState.bind_texture(texture, 0)
+                self.changes['texture'] += 1
+            if array != vertex_array:
+                vertex_array = array
+                GLState.bind_vertex_array(vertex_array)
+                self.changes['vertex_array'] += 1
+            drawable.draw_item(*arguments)
+        self.items.clear()
+
+        # camera looking towards -z: the farthest first, in graph order for a same depth
+        self.blended.sort(key=lambda item: item[:2])
+        self.draws += len(self.blended)
+        for _, _, drawable, arguments in self.blended:
+            RenderQueue.bind(drawable.state())
+            drawable.draw_item(*arguments)
+        self.blended.clear()
+
+    @staticmethod
+    def bind(state):
+        """ Set the state of a drawable drawn at once """
+        program, texture, vertex_array = state
+        GLState.use_program(program)
+        if texture:
+            GLState.bind_texture(texture, 0)
+        GLState.bind_vertex_array(vertex_array)
+
+    def report(self):
+        """ Counts of the last frame, as a printable line """
+        return '%d draws, %d program, %d texture and %d vertex array changes' % (
+            self.draws, self.changes['program'], self.changes['texture'], self.changes['vertex_array'])
+
+
+class FrustumCulling:
+    """
+    View frustum test of the drawables of the scene graph having a box, the
+    axis aligned box (lower, upper) holding what they draw in the
+    coordinates of the model matrix they are drawn with, see Node.box. While
+    a FrustumCulling is current, the drawables out of the view are skipped
+    with their whole subtree, and the subtrees fully inside are drawn
+    without further tests
+    """
+    current = None
+
+    def __init__(self):
+        self.inside = False     # drawing a subtree fully inside the view
+        # counts of the last frame, of the drawables and instances tested
+        self.drawn = self.culled = 0
+
+    def __enter__(self):
+        FrustumCulling.current = self
+        self.drawn = self.culled = 0
+        return self
+
+    def __exit__(self, *exception):
+        FrustumCulling.current = None
+
+    def test(self, matrix, lower, upper):
+        """ (partly, fully) inside booleans of the boxes, in the coordinates
+            matrix, e.g. projection @ view @ model, transforms from """
+        partly, fully = box_visibility(frustum_planes(matrix), lower, upper)
+        self.drawn += int(partly.sum())
+        self.culled += len(partly) - int(partly.sum())
+        return partly, fully
+
+    @staticmethod
+    def draw(drawables, projection, view, model):
+        """ Draw the drawables with the model matrix, but the ones out of the
+            view when culling; drawables without box are always drawn """
+        culling = FrustumCulling.current
+        if culling is None or culling.inside:
+            for drawable in drawables:
+                drawable.draw(projection, view, model)
+            return
+
+        drawables = list(drawables)
+        boxes = [getattr(drawable, 'box', None) for drawable in drawables]
+        partly, fully = np.ones(len(drawables), bool), np.zeros(len(drawables), bool)
+        known = [index for index, box in enumerate(boxes) if box is not None]
+        if known:
+            partly[known], fully[known] = culling.test(projection @ view @ model,
+                                                       *(np.array(side) for side in zip(*(boxes[i] for i in known))))
+        for drawable, shown, inside in zip(drawables, partly, fully):
+            if shown:
+                culling.inside = inside
+                drawable.draw(projection, view, model)
+        culling.inside = False
+
+    @staticmethod
+    def instances(box, matrix, transforms):
+        """ Which of the instances of a box placed by the transforms are
+            partly in the frustum of matrix, all of them when not culling """
+        culling = FrustumCulling.current
+        if culling is None or culling.inside or box is None:
+            return np.ones(len(transforms), bool)
+        return culling.test(matrix, *transformed_box(transforms, *box))[0]
+
+    def report(self):
+        """ Counts of the last frame, as a printable line """
+        return '%d boxes drawn and %d culled' % (self.drawn, self.culled)
 
 
 class Node:
     """ Scene graph transform and parameter broadcast node """
+    # number of changes of the scene graphs, making the boxes of the nodes
+    # computed before out of date
+    version = 0
+    # transform changing from frame to frame, e.g. with keys, so that the
+    # box of the node is unknown
+    animated = False
+
     def __init__(self, children=(), transform=identity()):
         """ Using a dictionary to store the name, by default a number """
         self.transform = transform
         self.children = {}
         self.skybox = None
+        self.content = (-1, None)   # graph version and box of the children
         for key, value in enumerate(list(iter(children))):
             self.children[key] = value
 
@@ -129,15 +539,32 @@ class Node:
             else:
                 tmp_dict.update({drawable[0]: drawable[1]})
         self.children.update(tmp_dict)
+        Node.version += 1
+
+    def content_box(self):
+        """ Box holding the children, in the coordinates they are drawn
+            with, None if unknown """
+        version, box = self.content
+        if version != Node.version:
+            box = union_box(getattr(child, 'box', None) for child in self.children.values())
+            self.content = Node.version, box
+        return box
+
+    @property
+    def box(self):
+        """ Box holding the subtree in the coordinates the node is drawn
+            with, None if unknown, e.g. some child has no box """
+        box = None if self.animated else self.content_box()
+        return None if box is None else transformed_box(self.transform, *box)
 
     def add_skybox(self, skybox):
         """ Add a skybox """
         self.skybox = skybox
 
     def draw(self, projection, view, model):
-        """ Recursive draw, passing down updated model matrix. """
-        for child in self.children.values():
-            child.draw(projection, view, model @ self.transform)
+        """ Recursive draw, passing down updated model matrix, and skipping
+            the children out of the view, see FrustumCulling """
+        FrustumCulling.draw(self.children.values(), projection, view, model @ self.transform)
 
     def draw_skybox(self, projection, view, model):
         """ Y en a-t-il besoin ? """
@@ -161,7 +588,7 @@ class Texture:
         try:
             # imports image as a numpy array in exactly right format
             tex = np.asarray(Image.open(file).convert('RGBA'))
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
+            GLState.bind_texture(self.glid)
             GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, tex.shape[1],
                             tex.shape[0], 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, tex)
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, wrap_mode)
@@ -176,6 +603,64 @@ class Texture:
 
     def __del__(self):  # delete GL texture from GPU when object dies
         GL.glDeleteTextures(self.glid)
+        GLState.forget(textures=[self.glid])
+
+
+class DataTexture:
+    """ Helper class for textures holding numpy arrays of floats, e.g. data
+        read by the shaders rather than images """
+    FORMATS = {1: (GL.GL_R32F, GL.GL_RED), 2: (GL.GL_RG32F, GL.GL_RG),
+               3: (GL.GL_RGB32F, GL.GL_RGB), 4: (GL.GL_RGBA32F, GL.GL_RGBA)}
+
+    def __init__(self, data, wrap_mode=GL.GL_CLAMP_TO_EDGE, filter_mode=GL.GL_NEAREST):
+        data = np.ascontiguousarray(data, np.float32)
+        internal_format, self.format = self.FORMATS[1 if data.ndim == 2 else data.shape[2]]
+        self.glid = GL.glGenTextures(1)
+        GLState.bind_texture(self.glid)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, internal_format, data.shape[1],
+                        data.shape[0], 0, self.format, GL.GL_FLOAT, data)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, wrap_mode)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, wrap_mode)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, filter_mode)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, filter_mode)
+
+    def update(self, data, x=0, y=0):
+        """ Replace the region of the texture starting at texel (x, y) """
+        data = np.ascontiguousarray(data, np.float32)
+        GLState.bind_texture(self.glid)
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, x, y, data.shape[1], data.shape[0],
+                           self.format, GL.GL_FLOAT, data)
+
+    def __del__(self):  # delete GL texture from GPU when object dies
+        GL.glDeleteTextures(self.glid)
+        GLState.forget(textures=[self.glid])
+
+
+class FrameBuffer:
+    """ Helper class to render into a texture rather than the window, used
+        as a context: the draw calls of the with block fill the texture """
+    def __init__(self, texture, width, height):
+        self.width, self.height = width, height
+        self.glid = GL.glGenFramebuffers(1)
+        previous = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.glid)
+        GL.glFramebufferTexture2D(GL.GL_DRAW_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0,
+                                  GL.GL_TEXTURE_2D, texture.glid, 0)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, previous)
+
+    def __enter__(self):
+        self.previous = GL.glGetIntegerv(GL.GL_DRAW_FRAMEBUFFER_BINDING)
+        self.viewport = GL.glGetIntegerv(GL.GL_VIEWPORT)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.glid)
+        GL.glViewport(0, 0, self.width, self.height)
+        return self
+
+    def __exit__(self, *exception):
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.previous)
+        GL.glViewport(*self.viewport)
+
+    def __del__(self):  # delete GL framebuffer from GPU when object dies
+        GL.glDeleteFramebuffers(1, [self.glid])
 
 
 class KeyFrames:
@@ -292,6 +777,14 @@ class Viewer(Node):
         # cyclic iterator to easily toggle polygon rendering modes
         self.fill_modes = cycle([GL.GL_LINE, GL.GL_POINT, GL.GL_FILL])
 
+        # camera, light and time shared by all the shaders
+        self.frame = FrameContext()
+        # meshes of the scene graph, drawn sorted by state
+        self.queue = RenderQueue()
+        self.gl_counts = GLState.counts()    # at the beginning of the last frame
+        # subtrees out of the view skipped
+        self.culling = FrustumCulling()
+
     def on_size(self, win, width, height):
         """ window size update => update viewport to new framebuffer size """
         GL.glViewport(0, 0, *glfw.get_framebuffer_size(win))
@@ -305,17 +798,17 @@ class Viewer(Node):
             win_size = glfw.get_window_size(self.win)
             view = self.trackball.view_matrix()
             projection = self.trackball.projection_matrix(win_size)
+            self.frame.update(projection, view)
+            self.gl_counts = GLState.counts()
 
-            # draw our scene objects
-            self.draw(projection, view, identity())
+            # draw our scene objects in the view, the queued ones when leaving
+            # the queue
+            with self.culling, self.queue:
+                self.draw(projection, view, identity())
 
-            # eliminating translations in the view matrix
-            # skybox of size 1 cf. vertex shader
+            # skybox of size 1 around the camera, cf. vertex shader
             GL.glDepthFunc(GL.GL_LEQUAL)
-            view_copy = copy.deepcopy(view)
-            for i in range(3):
-                view_copy[i,3] = 0
-            self.draw_skybox(projection, view_copy, identity())
+            self.draw_skybox(projection, view, identity())
             # back to the initial depth function
             GL.glDepthFunc(GL.GL_LESS)
 
@@ -332,5 +825,8 @@ class Viewer(Node):
                 glfw.set_window_should_close(self.win, True)
             if key == glfw.KEY_T:
                 GL.glPolygonMode(GL.GL_FRONT_AND_BACK, next(self.fill_modes))
+            if key == glfw.KEY_I:
+                print('Last frame:', self.queue.report() + ',', self.culling.report() + ',',
+                      GLState.report(self.gl_counts))
 
             self.key_handler(key)
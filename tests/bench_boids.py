@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Headless benchmark of the boids steps, brute force against spatial grid
+"""
+
+import sys
+import time
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '../')
+
+from src.flock import *
+
+SIZES = [100, 1000, 4000, 10000, 50000]
+BRUTE_FORCE_MAX = 4000      # the all-pairs test needs N^2 memory
+STEPS = 10
+
+
+def step_time(number, indexed):
+    """ Mean time of one simulation step, in milliseconds """
+    # the box grows with the flock to keep the same density of boids
+    flock = Flock(number, bound=1.5 * round(number ** (1./3)), indexed=indexed)
+    flock.step()
+    begin = time.perf_counter()
+    for _ in range(STEPS):
+        flock.step()
+    return (time.perf_counter() - begin) / STEPS * 1e3
+
+
+def main():
+    print("%8s | %16s | %16s" % ("boids", "brute force (ms)", "grid (ms)"))
+    for number in SIZES:
+        brute = "%16.2f" % step_time(number, False) if number <= BRUTE_FORCE_MAX else "%16s" % "-"
+        print("%8d | %s | %16.2f" % (number, brute, step_time(number, True)))
+
+
+if __name__ == '__main__':
+    main()
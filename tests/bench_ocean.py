@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Headless benchmark of the wave models: spectral ocean evaluated with FFTs
+against sums of Gerstner waves evaluated on the same grid
+"""
+
+import sys
+import time
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '../')
+
+import numpy as np
+
+from src.ocean import *
+
+RESOLUTIONS = [64, 128, 256, 512]
+WAVES = [4, 16]
+REPEATS = 5
+
+
+def timed(function, *args):
+    """ Mean time of a call, in milliseconds """
+    function(*args)
+    begin = time.perf_counter()
+    for _ in range(REPEATS):
+        function(*args)
+    return (time.perf_counter() - begin) / REPEATS * 1e3
+
+
+def main():
+    print("%10s | %10s | %13s | %12s | %s" % ("grid", "components", "phillips (ms)", "jonswap (ms)",
+                                             " | ".join("%d gerstner (ms)" % waves for waves in WAVES)))
+    for resolution in RESOLUTIONS:
+        spectral = [timed(SpectralOcean(resolution, spectrum=spectrum).evaluate, 1.)
+                    for spectrum in ('phillips', 'jonswap')]
+        x, z = np.meshgrid(np.arange(resolution, dtype=float), np.arange(resolution, dtype=float))
+        gerstner = [timed(gerstner_wave, x, z, 1., gerstner_waves(waves)) for waves in WAVES]
+        print("%10s | %10d | %13.2f | %12.2f | %s" % ("%dx%d" % (resolution, resolution), resolution**2,
+                                                     *spectral, " | ".join("%17.2f" % t for t in gerstner)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Headless benchmark of the boids steps spread over 1 to N processes
+"""
+
+import multiprocessing as mp
+import sys
+import time
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '../')
+
+from src.flock import *
+from src.parallel import *
+
+NUMBER = 50000
+STEPS = 10
+
+
+def step_time(flock):
+    """ Mean time of one simulation step, in milliseconds """
+    flock.step()
+    begin = time.perf_counter()
+    for _ in range(STEPS):
+        flock.step()
+    return (time.perf_counter() - begin) / STEPS * 1e3
+
+
+def main():
+    # the box grows with the flock to keep the same density of boids
+    bound = 1.5 * round(NUMBER ** (1./3))
+    serial = step_time(Flock(NUMBER, bound=bound))
+    print("%d boids, single process: %.2f ms" % (NUMBER, serial))
+    print("%8s | %10s | %8s" % ("workers", "step (ms)", "speedup"))
+    for workers in range(1, mp.cpu_count() + 1):
+        flock = ParallelFlock(Flock(NUMBER, bound=bound), workers)
+        duration = step_time(flock)
+        flock.close()
+        print("%8d | %10.2f | %8.2f" % (workers, duration, serial / duration))
+
+
+if __name__ == '__main__':
+    main()
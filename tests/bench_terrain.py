@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Headless benchmark of the terrain mesh generation, former per vertex loops
+against the vectorized generation, and of the chunk selection with the
+number of triangles it leaves to draw
+"""
+
+import os
+import sys
+import tempfile
+import time
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '../')
+
+from src import *
+
+SYNTHETIC_SIZE = 4096
+LOOP_MAX = 512      # bigger maps are timed with the loops on a crop and extrapolated
+
+
+def loop_attributes(attrib):
+    """ Former generation of TerrainAttributes, one vertex at a time """
+    number_vertices_x = attrib.height_map.size[0]
+    vertices = number_vertices_x**2 * [0]
+    normals = number_vertices_x**2 * [0]
+    vertex_pointer = 0
+    for i in range(number_vertices_x):
+        for j in range(number_vertices_x):
+            x = j / (number_vertices_x - 1) * attrib.size
+            y = attrib.get_height(j, i) + attrib.translation
+            z = i / (number_vertices_x - 1) * attrib.size
+            vertices[vertex_pointer] = (x, y, z)
+            normals[vertex_pointer] = attrib.compute_normal(j, i)
+            vertex_pointer += 1
+    vertices -= vec(attrib.size / 2, 0, attrib.size / 2)
+
+    indices = []
+    for z in range(number_vertices_x-1):
+        for x in range(number_vertices_x-1):
+            top_left = z * number_vertices_x + x
+            top_right = top_left + 1
+            bottom_left = (z + 1) * number_vertices_x + x
+            bottom_right = bottom_left + 1
+            indices += [top_left, bottom_left, top_right, top_right, bottom_left, bottom_right]
+    return vertices, normals, indices
+
+
+def grid_indices(number_vertices_x):
+    """
+    Indices of the two triangles of each square of a regular grid of
+    number_vertices_x**2 vertices, stored row by row
+    """
+    top_left = np.arange(number_vertices_x - 1)[None, :] + \
+               number_vertices_x * np.arange(number_vertices_x - 1)[:, None]
+    top_left = top_left.ravel()
+    top_right = top_left + 1
+    bottom_left = top_left + number_vertices_x
+    bottom_right = bottom_left + 1
+    indices = np.stack([top_left, bottom_left, top_right, top_right, bottom_left, bottom_right], axis=1)
+    indices = indices.ravel().astype(np.uint16 if number_vertices_x**2 <= 2**16 else np.uint32)
+    return indices
+
+
+def vectorized_attributes(attrib):
+    """ Vertices and normals of TerrainAttributes with the grid indices """
+    vertices, normals = attrib.generate_vertices()
+    return vertices, normals, grid_indices(attrib.height_map.size[0])
+
+
+def timed(function, *args):
+    """ Result and duration in seconds of a call """
+    begin = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - begin
+
+
+def compare(name, height_map):
+    attrib = TerrainAttributes("../img/granit.jpg", height_map, -10, 256, 200, 1000)
+    number_vertices_x = attrib.height_map.size[0]
+    (vertices, normals, indices), vectorized = timed(vectorized_attributes, attrib)
+
+    if number_vertices_x <= LOOP_MAX:
+        (ref_vertices, ref_normals, ref_indices), loops = timed(loop_attributes, attrib)
+        identical = (np.array_equal(vertices, ref_vertices) and np.array_equal(normals, np.array(ref_normals))
+                     and np.array_equal(indices, ref_indices))
+        check = "identical" if identical else "DIFFERENT"
+    else:
+        crop = TerrainAttributes("../img/granit.jpg", height_map, -10, 256, 200, 1000)
+        crop.height_map = crop.height_map.crop((0, 0, LOOP_MAX, LOOP_MAX))
+        _, loops = timed(loop_attributes, crop)
+        loops *= (number_vertices_x / LOOP_MAX)**2
+        check = "loops extrapolated"
+    print("%-24s %5d^2 | loops %9.2f s | vectorized %7.3f s | x%7.1f | %s"
+          % (name, number_vertices_x, loops, vectorized, loops / vectorized, check))
+    chunked(number_vertices_x, vertices)
+
+
+def chunked(number_vertices_x, vertices):
+    """ Triangles drawn by chunks for a view over and a view into the terrain """
+    chunks, build = timed(TerrainChunks, vertices, number_vertices_x, 64, 4, 1000 * 64 / (number_vertices_x - 1))
+    projection = perspective(35, 16 / 9, 1, 5000)
+    for view_name, eye, target in (("over", vec(0, 600, 600), vec(0, 0, 0)),
+                                   ("into", vec(-450, 50, -450), vec(0, -50, 0))):
+        planes = frustum_planes(projection @ lookat(eye, target, vec(0, 1, 0)))
+        (_, counts, _), select = timed(chunks.select, planes, eye)
+        print("%24s view %-4s | %5d chunks drawn %5d culled | select %6.2f ms | %5.1f%% of %d triangles"
+              % ("", view_name, chunks.drawn, chunks.culled, select * 1e3,
+                 100 * counts.sum() / 6 / (number_vertices_x - 1)**2, 2 * (number_vertices_x - 1)**2))
+    print("%24s build %.3f s" % ("", build))
+
+
+def main():
+    compare("perlin_noise.png", "../img/perlin_noise.png")
+
+    path = os.path.join(tempfile.gettempdir(), "synthetic_height_%d.png" % SYNTHETIC_SIZE)
+    if not os.path.exists(path):
+        steps = np.linspace(0, 8 * np.pi, SYNTHETIC_SIZE)
+        heights = 127.5 * (1 + np.sin(steps)[None, :] * np.cos(steps)[:, None])
+        Image.fromarray(heights.astype(np.uint8)).save(path)
+    compare("synthetic", path)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,10 +15,10 @@ def main():
     scene = Scene("../shaders/", light_dir=(0, 0, 0), camera_dist=50)
 
     # Shader
-    skinning_shader = scene.shaders['skinning']
+    skinning_shader = scene.shaders['skinning_instanced']
 
     # Boids
-    boids = Boids(skinning_shader, 27, "../obj/Fish/BlueTang/BlueTang.fbx", scaling=0.001, index=0, tex_file="../obj/Fish/BlueTang/BlueTang_Base_Color.png")
+    boids = Boids(skinning_shader, 27, "../obj/Fish/BlueTang/BlueTang.fbx", scaling=0.001, index=0, tex_file="../obj/Fish/BlueTang/BlueTang_Base_Color.png", instanced=True)
    
     scene.add(boids)
 
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Test recording of a boids run offline and its replay
+"""
+
+import os
+import sys
+import tempfile
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '../')
+
+from src import *
+
+NUMBER = 1000
+TICKS = 1200
+
+
+def main():
+    # Offline simulation, only done once
+    path = os.path.join(tempfile.gettempdir(), "fish_shoal_%d.boids" % NUMBER)
+    if not os.path.exists(path):
+        print("Recording %d ticks of %d boids in %s..." % (TICKS, NUMBER, path))
+        record(Flock(NUMBER, bound=20), path, TICKS)
+
+    # Scene creation
+    scene = Scene("../shaders/", light_dir=(0, 0, 0), camera_dist=80)
+
+    # Shader
+    skinning_shader = scene.shaders['skinning_instanced']
+
+    # Boids played back from the recording
+    boids = Boids(skinning_shader, NUMBER, "../obj/Fish/BlueTang/BlueTang.fbx", scaling=0.001, index=0, tex_file="../obj/Fish/BlueTang/BlueTang_Base_Color.png", instanced=True, replay=path)
+
+    scene.add(boids)
+
+    scene.viewer.run()
+
+if __name__ == '__main__':
+    glfw.init()
+    main()
+    glfw.terminate()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Test of an unbounded sea floor generated around the camera from noise
+"""
+
+import os
+import sys
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '../')
+
+from src import *
+
+
+def main():
+    # Scene creation
+    scene = Scene("../shaders/", light_dir=(0, 1, 1), camera_dist=400)
+
+    # Sea floor generated by as many threads as cores, 4 m between samples
+    floor = ProceduralHeights(amplitude=60, frequency=1 / 256, octaves=6, seed=1)
+    scene.generate_streaming_terrain("../img/granit.jpg", floor, 4, translation=-40, radius=4,
+                                     workers=os.cpu_count())
+
+    scene.viewer.run()
+
+
+if __name__ == '__main__':
+    glfw.init()
+    main()
+    glfw.terminate()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Test of a terrain streamed tile by tile from a large raw height map
+"""
+
+import os
+import sys
+import tempfile
+# insert at 1, 0 is the script path (or '' in REPL)
+sys.path.insert(1, '../')
+
+from src import *
+
+SIZE = 4097
+
+
+def main():
+    # Synthetic height map, only written once
+    path = os.path.join(tempfile.gettempdir(), "synthetic_height_%d.heights" % SIZE)
+    if not os.path.exists(path):
+        print("Writing a %d^2 height map in %s..." % (SIZE, path))
+        steps = np.linspace(0, 64 * np.pi, SIZE, dtype=np.float32)
+        samples = 32767.5 * (1 + np.sin(steps)[None, :] * np.cos(steps)[:, None])
+        save_heightmap(path, samples.astype(np.uint16), scale=200 / 65535, offset=-100)
+
+    # Scene creation
+    scene = Scene("../shaders/", light_dir=(0, 1, 1), camera_dist=400)
+
+    # Terrain streamed around the camera, 4 m between samples
+    scene.generate_streaming_terrain("../img/granit.jpg", path, 4, radius=4, upload_budget=4)
+
+    scene.viewer.run()
+
+
+if __name__ == '__main__':
+    glfw.init()
+    main()
+    glfw.terminate()